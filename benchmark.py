@@ -0,0 +1,121 @@
+'''
+Benchmark of the fan test sequence, runs Controller.initialList -> runJob without GUI on the simulated
+instruments of simulator.py and reports the time of every sample and job, the SCPI round trips,
+the workbook save time and the peak memory as json.
+
+Typical usage:
+    python benchmark.py                                  # 1 sample, bench latency
+    python benchmark.py -n 3 --latency_scale 0 -o result.json
+    python benchmark.py --no_lock_current --trace trace.json
+'''
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import openpyxl
+import model
+import view
+from controller import Controller
+from model import ReportSession
+from tracing import tracer
+
+def run_sample(controller:Controller, sample_no:int, file_name:str):
+    '''
+    test one sample like StationRunner, return the wall time and the list of jobs with their time and I/O count
+    '''
+    jobs = []
+    controller.view.state = controller.view.State.Testing
+    start = time.perf_counter()
+    controller.start(sample_no, file_name)
+    while controller.view.state == controller.view.State.Testing:
+        job = controller.job_list.waitDue(timeout=0.5)
+        if job is None:
+            if len(controller.job_list) == 0:
+                controller.stop()
+            continue
+        io_count = tracer.ioCount()
+        t1 = time.perf_counter()
+        controller.runJob(job)
+        jobs.append({'job': job[1].__qualname__, 'start': t1 - start, 'seconds': time.perf_counter() - t1,
+                     'io_count': tracer.ioCount() - io_count})
+    return time.perf_counter() - start, jobs
+
+def benchmark(samples:int = 1, latency_scale:float = 1.0, scale_no:int = 0, answers:dict = None,
+              template:str = ReportSession.template, directory:str = None, seed:int = 0):
+    '''
+    run the test sequence on samples and return the result as dictionary
+    '''
+    directory = directory or tempfile.mkdtemp(prefix='fan_benchmark_')
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.exists(template):
+        # the report template is not in the repo, an empty workbook has the same I/O path
+        template = os.path.join(directory, 'template.xlsx')
+        openpyxl.Workbook().save(template)
+    tracer.clear()
+    tracer.enable(tracer.file_name)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    model_ = model.Model(simulate=True, latency_scale=latency_scale, seed=seed)
+    model_.listDevices()
+    station = model_.stations[0]
+    model_.connectStation(station, *model_.rm.list_resources()[:3])
+    report = ReportSession(template)
+    controller = Controller(model_, view.HeadlessView('benchmark', answers=answers), station, report)
+    controller.scale_no = scale_no
+    setup_time = time.perf_counter() - t0
+
+    file_name = os.path.join(directory, 'report.xlsx')
+    results = []
+    for sample_no in range(1, samples + 1):
+        io_count = tracer.ioCount()
+        seconds, jobs = run_sample(controller, sample_no, file_name)
+        results.append({'sample': sample_no, 'seconds': seconds, 'io_count': tracer.ioCount() - io_count, 'jobs': jobs})
+    t1 = time.perf_counter()
+    station.osc.waitTransfers()
+    report.close()
+    close_time = time.perf_counter() - t1
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    summary = tracer.summary()
+    return {'python': platform.python_version(),
+            'latency_scale': latency_scale,
+            'scale_no': scale_no,
+            'setup_seconds': setup_time,
+            'close_seconds': close_time,
+            'total_seconds': time.perf_counter() - t0,
+            'sample_seconds': [r['seconds'] for r in results],
+            'io_count': tracer.ioCount(),
+            'io_seconds': sum(c['total'] for c in summary['commands']),
+            'workbook_save_seconds': report.save_time,
+            'peak_memory_bytes': peak,
+            'samples': results,
+            'jobs': summary['jobs'],
+            'commands': summary['commands']}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the fan test sequence on simulated instruments')
+    parser.add_argument('-n', '--samples', type=int, default=1, help='number of tested samples')
+    parser.add_argument('--latency_scale', type=float, default=1.0, help='multiply the latency of the simulated instruments, 0 for no delay')
+    parser.add_argument('--scale', type=int, default=0, help='index of Controller.scale_list')
+    parser.add_argument('--no_lock_current', action='store_true', help='answer no to measuring the lock current')
+    parser.add_argument('--template', type=str, default=ReportSession.template, help='report template')
+    parser.add_argument('-d', '--directory', type=str, default=None, help='directory of the report and hard copies, default a temporary directory')
+    parser.add_argument('-o', '--output', type=str, default=None, help='json file of the result, default print')
+    parser.add_argument('--trace', type=str, default=None, help='also save the I/O trace to this .json or .csv file')
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        tracer.file_name = args.trace
+    answers = {'Measure Max. Lock Current?': not args.no_lock_current}
+    result = benchmark(args.samples, args.latency_scale, args.scale, answers, args.template, args.directory)
+    text = json.dumps(result, indent=1)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print('sample seconds: %s, io count: %d, result saved: %s'%(result['sample_seconds'], result['io_count'], args.output))
@@ -1,18 +1,31 @@
 import model
+from model import ReportSession
+from tracing import tracer
 import view
+import gui_log
 import time
 import argparse
+import json
+import queue
+import threading
 
 class Controller:
-    def __init__(self, model:model.Model, view:view.View) -> None:
+    def __init__(self, model:model.Model, view:view.View, station:model.Station = None, report:ReportSession = None) -> None:
+        '''
+        Parameters
+        ----------
+        station : the bench running the test sequence, default the first station of the model
+        report : report session shared by stations writing the same report, default a new session
+        '''
         self.model = model
         self.view = view
-        self.job_list = list()
+        self.station = station if station is not None else model.stations[0]
+        self.job_list = JobScheduler()
         self.sample_no = 0
         self.new_file_name = ''
         self.new_file_dir = ''
-        self.start_time = 0
-        self.last_job = None
+        # the parameter model shadows the module here
+        self.report = report if report is not None else ReportSession()
         self.scale_list = [ScaleSetting(12.0, 7.0,    13.2, 0.2, 1, 1, 1, 1, 1, 1),
                            ScaleSetting(12.0, 7.0,    13.2, 0.2, 2, 2, 2, 2, 2, 1),
                            ScaleSetting(12.0, 7.0,    13.2, 0.2, 5, 5, 5, 5, 5, 2),
@@ -20,18 +33,29 @@ class Controller:
                            ScaleSetting(12.0, 10.8,   13.2, 0.2, 5, 5, 5, 5, 5, 2),
                            ScaleSetting(48.0, 36.0,   60.0, 0.2, 1, 1, 1, 1, 1, 1)]
         self.scale_no = 0
+        # settle detection of the PWM steps and the low voltage step, keyword arguments of model.SettleDetector
+        self.settle = dict(window=5, tolerance=0.02, min_time=1.0, max_time=15.0)
+        self.low_voltage_settle = dict(window=3, tolerance=0.05, min_time=0.5, max_time=3.0, drift=0.05)
+        self.settle_interval = 0.2 # seconds between the samples of settle detection
 
     def start(self, sample_no:int, dir:str):
         """
         Start testing, prepare a priority queue to store the test processes
         """
         try:
+            # no device scan on the bus during the test
+            self.model.pauseDiscovery()
             # prepare a priority queue to store the test processes
             self.sample_no = sample_no
             self.new_file_name = dir
             self.new_file_dir = model.os.path.dirname(dir) + '/'
+            self.report.open(self.new_file_name)
+            # settings may be changed on the front panel between samples, send every setting once per sample
+            for inst in (self.station.osc, self.station.power, self.station.signal):
+                inst.invalidate()
+            self.view.clearTrend()
             self.initialList()
-            self.start_time = time.perf_counter()
+            self.job_list.start()
             
         except ValueError as error:
             # show an error message
@@ -41,35 +65,68 @@ class Controller:
         """
         when pause button is clicked, stop power supply output
         """
-        self.model.power.setOutputOff()
+        self.job_list.pause()
+        self.station.power.setOutputOff()
 
     def stop(self):
         """
         when stop button is clicked, stop power supply output, clear the job list
         """
-        self.model.power.setOutputOff()
+        self.station.power.setOutputOff()
         self.job_list.clear()
+        self.report.flush()
+        if tracer.enabled and tracer.file_name is not None:
+            tracer.dump()
+        self.model.resumeDiscovery()
         # in the end of the test, add an auto stop, change the state machine, for a new round to start
-        self.view.state = view.View.State.Stopped
-
-    def runTest(self):
-        """
-        when the state is testing, execute job to update the communication orders periodically with devices
-        """
-        now = time.perf_counter()
-        if len(self.job_list) > 0:
-            job = self.job_list[0]
-            if now - self.start_time > job[0]:
-                self.start_time = now
-                print("doing task: "+ job[1].__qualname__)
-                self.last_job = self.job_list.pop(0)
-                if len(job) > 2:
-                    job[1](*job[2:])
-                else:
-                    job[1]()
-    
+        self.view.state = self.view.State.Stopped
+
+    def runJob(self, job:tuple):
+        """
+        execute one job of the test sequence
+        """
+        if job[1] != self.pollUntil: # polling is too frequent to print
+            print("doing task: "+ job[1].__qualname__)
+        with tracer.job(job[1].__qualname__):
+            job[1](*job[2:])
+        # step boundary, save the report in background if any cell is written
+        self.report.flush()
+
+    def waitUntil(self, condition, timeout:float, then:list, delay:float = 0.01, max_interval:float = 0.1, name:str = 'condition',
+                  interval:float = 0.01):
+        """
+        check the condition with a polling job at the head of the job list, first after delay seconds,
+        then with interval growing up to max_interval, the GUI keeps running between the checks.
+        When the condition is met or timeout, the jobs of then are inserted at the head of the list.
+        :param then: list of jobs, tuple(trigger time, action_function, *action_parameters)
+        """
+        self.job_list.insert(0, (delay, self.pollUntil, condition, time.monotonic() + timeout, then, interval, max_interval, name))
+
+    def pollUntil(self, condition, deadline:float, then:list, interval:float, max_interval:float, name:str):
+        done = condition()
+        if not done and time.monotonic() < deadline:
+            self.job_list.insert(0, (interval, self.pollUntil, condition, deadline, then, min(interval * 1.5, max_interval), max_interval, name))
+            return
+        if not done:
+            self.view.show_error('Timeout waiting for %s'%name)
+        for i, job in enumerate(then):
+            self.job_list.insert(i, job)
+
     def getSampleNo(self):
         return self.sample_no
+
+    def plotTrend(self, fg:int = 2):
+        """
+        callback of SettleDetector adding the samples to the RPM/current trend of the view
+        """
+        return lambda frequency, current: self.view.addTrend(frequency / fg * 60.0, current)
+
+    def plotWaveform(self):
+        """
+        show FG and current of the last acquisition, only if the view plots them
+        """
+        if self.view.plotting:
+            self.view.showWaveform(self.station.osc.previewWaveforms())
     
     def initialList(self):
         """
@@ -101,12 +158,11 @@ class Controller:
             10s,記錄CURRENT(MAX) P欄
         * show success message
         """
-        self.job_list.append((0, self.model.power.reset))
-        self.job_list.append((0, self.model.signal.reset))
+        self.job_list.append((0, self.resetSources))
         self.job_list.append((0, self.setupDisplay, 'Reset Measurement badge?'))
-        self.job_list.append((0, self.model.power.setVoltage, self.scale_list[self.scale_no].ratedV))
-        self.job_list.append((0, self.model.power.setCurrent, 10))
-        self.job_list.append((0, self.model.signal.setPWMOutput))
+        self.job_list.append((0, self.station.power.setVoltage, self.scale_list[self.scale_no].ratedV))
+        self.job_list.append((0, self.station.power.setCurrent, 10))
+        self.job_list.append((0, self.station.signal.setPWMOutput))
         self.job_list.append((0, self.meanRPMandCurrentOfPWM, 100, 2, True, '100_pwm', ['H'], ['I','N'], ['M']))
         self.job_list.append((0, self.meanRPMandCurrentOfPWM, 50, 2, True, '50_pwm', ['F'], ['G']))
         self.job_list.append((0, self.meanRPMandCurrentOfPWM, 0, 2, True, '0_pwm', ['D'], ['E']))
@@ -121,8 +177,10 @@ class Controller:
         """
         resume from pause
         """
-        self.start_time = time.perf_counter()
-        self.job_list.insert(0, self.last_job)
+        # the instruments may be adjusted by hand while paused
+        for inst in (self.station.osc, self.station.power, self.station.signal):
+            inst.invalidate()
+        self.job_list.resume()
 
     def deviceReady(self, osc_id: str, power_id:str, signal_id:str):
         """
@@ -130,24 +188,25 @@ class Controller:
         """
         res = True
         try:
-            self.model.connectDevice(self.model.id_dict[osc_id], self.model.osc)
+            self.model.connectDevice(self.model.id_dict[osc_id], self.station.osc)
         except ValueError as e:
             self.view.show_error(e)
             res = False
         try:   
-            self.model.connectDevice(self.model.id_dict[power_id], self.model.power)
+            self.model.connectDevice(self.model.id_dict[power_id], self.station.power)
         except ValueError as e:
             self.view.show_error(e)
             res = False
         try:
-            self.model.connectDevice(self.model.id_dict[signal_id], self.model.signal)
+            self.model.connectDevice(self.model.id_dict[signal_id], self.station.signal)
         except ValueError as e:
             self.view.show_error(e)
             res = False
         return res
     
     def selectDevices(self):
-        self.model.listDevices()
+        # the discovery thread scans the resources, only take its events here
+        self.model.applyDeviceEvents()
         self.updateDeviceList(self.model.osc, 'osc')
         self.updateDeviceList(self.model.signal, 'signal')
         self.updateDeviceList(self.model.power, 'power')
@@ -168,96 +227,112 @@ class Controller:
 
     def meanRPMandCurrentOfPWM(self, pwm:float = 0.0, fg:int = 2, hard_copy = False, hard_copy_file_name = 'hard_copy',
                                      col_rpm = None, col_curr = None, col_curr_max = None):
-        self.model.signal.setPWMDuty(pwm)
-        self.model.signal.setOutputOn()
-        self.model.power.setOutputOn()
+        osc, power, signal = self.station.osc, self.station.power, self.station.signal
+        # the oscilloscope is set up while the signal generator changes the duty
+        signal_ready = [signal.submit(signal.setPWMDuty, pwm), signal.submit(signal.setOutputOn)]
+        osc_ready = [osc.submit(osc.scope.write, 'acquire:state 0')] # stop until power on
         if pwm == 0.0:
-            self.model.osc.setScale(scale=self.scale_list[self.scale_no].duty0)
+            osc_ready.append(osc.submit(osc.setScale, scale=self.scale_list[self.scale_no].duty0))
         elif pwm == 50.0:
-            self.model.osc.setScale(scale=self.scale_list[self.scale_no].duty50)
+            osc_ready.append(osc.submit(osc.setScale, scale=self.scale_list[self.scale_no].duty50))
         elif pwm == 100.0:
-            self.model.osc.setScale(scale=self.scale_list[self.scale_no].duty100)
+            osc_ready.append(osc.submit(osc.setScale, scale=self.scale_list[self.scale_no].duty100))
             # delete meas1 and add new measurement
-            self.model.osc.scope.write('MEASUREMENT:DELETE "MEAS1"')
-            self.model.osc.addMeasurement(9, self.model.osc.Channel.current, 'PDUTY', reset = True)
-
-        self.model.osc.scope.write('ACQUIRE:STATE RUN')
-        # check signal channel has value
-        if pwm == 50.0:
-            self.job_list.insert(0, (1, self.model.osc.check_PWM_and_FG, self.sample_no, self.new_file_name, ['K'], ['R']))
-        
-        self.job_list.insert(0, (10, self.model.osc.measure_RPM_and_Curr, pwm, fg, self.sample_no, self.new_file_name, col_rpm, col_curr, col_curr_max))
-        # add meas1 back
-        if pwm == 100.0:
-            self.job_list.insert(1, (0, self.model.osc.scope.write, 'MEASUREMENT:DELETE "MEAS9"'))
-            self.job_list.insert(2, (0, self.model.osc.addMeasurement, 1, self.model.osc.Channel.vcc, 'TOP', True))
-
+            osc_ready.append(osc.submit(osc.deleteMeasurement, 1))
+            osc_ready.append(osc.submit(osc.addMeasurement, 9, osc.Channel.current, 'PDUTY', reset = True))
+        # power on after the duty is set
+        model.waitAll(signal_ready)
+        model.waitAll([power.submit(power.setOutputOn)] + osc_ready)
+        # the settle detection only sees acquisitions after power on
+        osc.runContinuous()
+        settled = [(0, osc.measure_RPM_and_Curr, pwm, fg, self.sample_no, self.report, col_rpm, col_curr, col_curr_max),
+                   (0, self.plotWaveform)]
         if hard_copy:
             hard_copy_file_name = 's%d/%s_s%d'%(self.getSampleNo(), hard_copy_file_name, self.getSampleNo())
-            self.job_list.insert(1, (0, self.model.osc.saveHardcopy, self.new_file_dir + hard_copy_file_name))
+            settled.append((0, osc.saveHardcopy, self.new_file_dir + hard_copy_file_name))
+        # add meas1 back
+        if pwm == 100.0:
+            settled.append((0, osc.deleteMeasurement, 9))
+            settled.append((0, osc.addMeasurement, 1, osc.Channel.vcc, 'TOP', True))
+        # check signal channel has value
+        if pwm == 50.0:
+            settled.append((1, osc.check_PWM_and_FG, self.sample_no, self.report, ['K'], ['R']))
+        # measure as soon as the fan speed and current are steady
+        detector = model.SettleDetector(osc, callback=self.plotTrend(fg), **self.settle)
+        self.waitUntil(detector.settled, detector.max_time + 5, settled, self.settle_interval, self.settle_interval,
+                       '%d%% duty settled'%pwm, self.settle_interval)
         
     def lowVoltage(self, col_pwm = None, col_fg = None):
-        self.model.power.setVoltage(self.scale_list[self.scale_no].lowV)
-        self.model.power.setCurrent(10)
-        self.model.signal.setPWMDuty(10)
-        self.model.signal.setOutputOn()
-        self.model.power.setOutputOn()
-        self.model.osc.setScale(scale=self.scale_list[self.scale_no].low)
-        self.model.osc.scope.write('ACQUIRE:STATE RUN')
-        self.job_list.insert(0, (3, self.model.osc.check_PWM_and_FG, self.sample_no, self.new_file_name, col_pwm, col_fg))
-        self.job_list.insert(1, (0, self.model.power.setOutputOff))
+        osc, power, signal = self.station.osc, self.station.power, self.station.signal
+        power_ready = [power.submit(power.setVoltage, self.scale_list[self.scale_no].lowV), power.submit(power.setCurrent, 10)]
+        signal_ready = [signal.submit(signal.setPWMDuty, 10), signal.submit(signal.setOutputOn)]
+        osc_ready = [osc.submit(osc.scope.write, 'acquire:state 0'), # stop until power on
+                     osc.submit(osc.setScale, scale=self.scale_list[self.scale_no].low)]
+        # power on after the duty is set
+        model.waitAll(power_ready + signal_ready)
+        model.waitAll([power.submit(power.setOutputOn)] + osc_ready)
+        # the settle detection only sees acquisitions after power on
+        osc.runContinuous()
+        detector = model.SettleDetector(osc, callback=self.plotTrend(), **self.low_voltage_settle)
+        self.waitUntil(detector.settled, detector.max_time + 5,
+                       [(0, osc.check_PWM_and_FG, self.sample_no, self.report, col_pwm, col_fg), (0, power.setOutputOff)],
+                       self.settle_interval, self.settle_interval, 'low voltage settled', self.settle_interval)
     
     def writeSpecFromGUI(self, cols):
         '''
         write spec from user input GUI box
         write low voltage spec from user option
         '''
-        wb = self.model.osc.load_report(self.new_file_name)
-        sheet = wb.active
         spec = self.view.getSpecValue()
         row = '10'
         for s, col in zip(spec, cols):
-            if (sheet[col + row].value == None):
-                sheet[col + row] = s
+            self.report.write(col + row, s)
         
-        if sheet['L' + row].value == None:
-            sheet['L' + row] = '%s V'%self.scale_list[self.scale_no].lowV
-        wb.save(self.new_file_name)
-        wb.close()
+        self.report.write('L' + row, '%s V'%self.scale_list[self.scale_no].lowV)
+        self.report.flush()
+
+    def resetSources(self):
+        """
+        reset power supply and signal generator at the same time
+        """
+        model.waitAll([self.station.power.submit(self.station.power.reset), self.station.signal.submit(self.station.signal.reset)])
 
     def setupDisplay(self, msg = 'msg'):
-        res = True if view.sg.popup_yes_no(msg, keep_on_top=True) == 'Yes' else False
-        self.model.osc.setMeasurement(reset= res)
+        res = self.view.askYesNo(msg)
+        self.station.osc.setMeasurement(res=res)
 
     def maxCurrent(self, popup_msg = None, col=None, hard_copy = False, hard_copy_file_name:str = 'hard_copy', scale = 1.0):
-        button = view.sg.popup_yes_no(popup_msg, keep_on_top=True) if popup_msg is not None else 'Yes'
+        button = self.view.askYesNo(popup_msg) if popup_msg is not None else True
 
-        if button != 'Yes':
+        if not button:
             return None
         else:
-            self.model.power.setVoltage(self.scale_list[self.scale_no].highV)
-            self.model.power.setCurrent(10)
-            self.model.signal.setPWMDuty(100)
-            self.model.osc.setScale(type='H', scale=self.scale_list[self.scale_no].max_curr_horizontal)
-            self.model.osc.setScale(scale = scale)
-            self.model.osc.scope.write('acquire:state 0') # stop
-            self.model.osc.setTrigger(self.model.osc.Channel.current, 2.0)
-            self.model.osc.scope.write('acquire:stopafter SEQUENCE') # single
-            self.model.osc.scope.write('acquire:state 1') # start
-            while(self.model.osc.scope.query('TRIGger:STATE?') != 'READY\n'):
-                time.sleep(1)
-            # ready for test
-            self.job_list.insert(0, (0, self.model.signal.setOutputOn))
-            self.job_list.insert(1, (0, self.model.power.setOutputOn))
-            after_sec = 7 * self.scale_list[self.scale_no].max_curr_horizontal
-            # make sure the sequence data has acquired
-            # use *opc? to ensure the output display are shown
-            self.job_list.insert(2, (after_sec, self.model.osc.scope.query, '*opc?'))
-            self.job_list.insert(3, (0, self.model.power.setOutputOff))
-            self.job_list.insert(4, (0, self.model.osc.measure_RPM_and_Curr, 100, 2, self.sample_no, self.new_file_name, None, None, col))
+            osc, power, signal = self.station.osc, self.station.power, self.station.signal
+            model.waitAll([power.submit(power.setVoltage, self.scale_list[self.scale_no].highV),
+                           power.submit(power.setCurrent, 10),
+                           signal.submit(signal.setPWMDuty, 100),
+                           osc.submit(osc.setScale, type='H', scale=self.scale_list[self.scale_no].max_curr_horizontal),
+                           osc.submit(osc.setScale, scale = scale),
+                           osc.submit(osc.scope.write, 'acquire:state 0'), # stop
+                           osc.submit(osc.setTrigger, osc.Channel.current, 2.0),
+                           osc.submit(osc.scope.write, 'acquire:stopafter SEQUENCE'), # single
+                           osc.submit(osc.scope.write, 'acquire:state 1'), # start
+                           osc.submit(osc.armSequenceNotice)])
+            # after the sequence is captured
+            captured = [(0, power.setOutputOff),
+                        (0, osc.measure_RPM_and_Curr, 100, 2, self.sample_no, self.report, None, None, col),
+                        (0, self.plotWaveform)]
             if hard_copy:
                 hard_copy_file_name = 's%d/%s_s%d'%(self.getSampleNo(), hard_copy_file_name, self.getSampleNo())
-                self.job_list.insert(5, (0, self.model.osc.saveHardcopy, self.new_file_dir + hard_copy_file_name))
+                captured.append((0, osc.saveHardcopy, self.new_file_dir + hard_copy_file_name))
+            # the trigger point is at 20% of the record, the sequence is not captured earlier than 7 divisions after power on
+            horizontal = self.scale_list[self.scale_no].max_curr_horizontal
+            # power on as soon as the trigger is armed
+            self.waitUntil(osc.triggerReady, 10, [(0, signal.setOutputOn),
+                                                  (0, power.setOutputOn),
+                                                  (0, self.waitUntil, osc.sequenceDone, 10 * horizontal + 5, captured,
+                                                      7 * horizontal, 0.1, 'single sequence')],
+                           name='trigger armed')
 
 class ScaleSetting:
     def __init__(self, ratedV: float, lowV:float, highV:float,
@@ -282,19 +357,307 @@ class ScaleSetting:
     def getName(self) -> str:
         return '%.1f\t ~ %.1f V  %i A/div'%(self.lowV, self.highV, self.start) 
 
+class JobScheduler:
+    """
+    Ordered test sequence with monotonic deadlines.
+    Each job is tuple(trigger time in sec after the start of last job, action_function, *action_parameters).
+    Jobs are chained to the start of the previous job, so the sequence stays in insertion order and
+    only the head carries a deadline, which is computed from time.monotonic() when asked.
+    Jobs inserted at the head by a running job (polling, follow-up measurements) belong to the step that inserted them,
+    resume() drops them and does the step again.
+    """
+    def __init__(self) -> None:
+        self.jobs = list()
+        self.last_job = None
+        self.step = None # last popped job that is not inserted by another job
+        self.inserted = 0 # number of jobs at the head inserted by the step
+        self.anchor = time.monotonic() # start time of last job
+        self.paused = False
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.jobs)
+
+    def append(self, job:tuple):
+        with self.cond:
+            self.jobs.append(job)
+            self.cond.notify_all()
+
+    def insert(self, index:int, job:tuple):
+        with self.cond:
+            self.jobs.insert(index, job)
+            if index <= self.inserted:
+                self.inserted += 1
+            self.cond.notify_all()
+
+    def clear(self):
+        with self.cond:
+            self.jobs.clear()
+            self.step = None
+            self.inserted = 0
+            self.cond.notify_all()
+
+    def start(self):
+        """
+        the first job counts its trigger time from now
+        """
+        with self.cond:
+            self.anchor = time.monotonic()
+            self.paused = False
+            self.cond.notify_all()
+
+    def pause(self):
+        with self.cond:
+            self.paused = True
+            self.cond.notify_all()
+
+    def resume(self):
+        """
+        resume from pause, the interrupted step is done again with its trigger time counted from now,
+        the jobs it inserted (ex: a polling chain with its deadline) are dropped, the step inserts them again
+        """
+        with self.cond:
+            del self.jobs[:self.inserted]
+            self.inserted = 0
+            if self.step is not None:
+                self.jobs.insert(0, self.step)
+            self.anchor = time.monotonic()
+            self.paused = False
+            self.cond.notify_all()
+
+    def deadline(self):
+        """
+        monotonic time when the head job is due, None if there is no job or paused
+        """
+        with self.cond:
+            if self.paused or len(self.jobs) == 0:
+                return None
+            return self.anchor + self.jobs[0][0]
+
+    def timeout(self):
+        """
+        seconds until the head job is due, None if there is no job or paused
+        """
+        deadline = self.deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def popDue(self):
+        """
+        pop the head job if its deadline has passed, otherwise return None
+        """
+        with self.cond:
+            deadline = self.deadline()
+            now = time.monotonic()
+            if deadline is None or now < deadline:
+                return None
+            self.anchor = now
+            self.last_job = self.jobs.pop(0)
+            if self.inserted > 0:
+                self.inserted -= 1
+            else:
+                self.step = self.last_job
+            return self.last_job
+
+    def waitDue(self, timeout:float = None):
+        """
+        block until the head job is due and pop it, the waiting is woken up when jobs are changed
+        :return: the job, or None if timeout
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                job = self.popDue()
+                if job is not None:
+                    return job
+                wait = self.timeout()
+                if end is not None:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.cond.wait(wait)
+
+class StationRunner(threading.Thread):
+    """
+    Run the test sequence of one station on its own thread, sample after sample.
+    """
+    def __init__(self, controller:Controller, samples:list, file_name:str) -> None:
+        super().__init__(name=controller.station.name, daemon=True)
+        self.controller = controller
+        self.samples = samples
+        self.file_name = file_name
+
+    def run(self):
+        controller = self.controller
+        for sample_no in self.samples:
+            if not controller.view.askYesNo('Sample No.%d is ready for test?'%sample_no):
+                break
+            controller.view.state = controller.view.State.Testing
+            controller.start(sample_no, self.file_name)
+            try:
+                while controller.view.state == controller.view.State.Testing:
+                    job = controller.job_list.waitDue(timeout=0.5)
+                    if job is not None:
+                        controller.runJob(job)
+                    elif len(controller.job_list) == 0:
+                        # start failed, nothing to do
+                        controller.stop()
+            except Exception as e:
+                controller.view.show_error(repr(e))
+                controller.stop()
+                break
+
+class ControllerThread:
+    """
+    Run the test sequence of the GUI on a worker thread, so the window keeps handling events during a long step.
+    start() and resumeTest() are queued to the worker, pause() and stop() act at once on the calling thread:
+    the power supply is turned off even while the worker waits in the middle of a step.
+    Other attributes are passed to the controller.
+    """
+    def __init__(self, controller:Controller) -> None:
+        object.__setattr__(self, 'controller', controller)
+        object.__setattr__(self, 'commands', queue.Queue()) # tuple(function, *args) run on the worker
+        object.__setattr__(self, 'stopped', threading.Event()) # set by stop() until the next start
+        object.__setattr__(self, 'thread', threading.Thread(target=self.run, name='test sequence', daemon=True))
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.controller, name, value)
+
+    def start(self, sample_no:int, dir:str):
+        self.commands.put((self.begin, sample_no, dir))
+
+    def begin(self, sample_no:int, dir:str):
+        self.stopped.clear()
+        # the deferred stop of the previous test may have set the state after the GUI set it for this start
+        self.controller.view.state = self.controller.view.State.Testing
+        self.controller.start(sample_no, dir)
+
+    def resumeTest(self):
+        self.commands.put((self.controller.resumeTest,))
+
+    def pause(self):
+        self.controller.pause()
+
+    def stop(self):
+        """
+        turn off the power and drop the jobs now, the rest of Controller.stop() runs on the worker after the current job
+        """
+        self.stopped.set()
+        self.controller.job_list.clear()
+        self.controller.station.power.setOutputOff()
+        self.commands.put((self.controller.stop,))
+
+    def close(self, timeout:float = 10.0):
+        """
+        stop the worker after the queued commands
+        """
+        self.commands.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        controller = self.controller
+        while True:
+            try:
+                # wait for a command only if there is no test running
+                testing = controller.view.state == controller.view.State.Testing and not self.stopped.is_set()
+                command = self.commands.get_nowait() if testing else self.commands.get(timeout=0.1)
+            except queue.Empty:
+                command = ()
+            if command is None:
+                break
+            try:
+                if command:
+                    command[0](*command[1:])
+                    continue
+                if not testing:
+                    continue
+                job = controller.job_list.waitDue(timeout=0.05)
+                if job is not None:
+                    controller.runJob(job)
+                    if self.stopped.is_set():
+                        # the job may have added jobs after stop
+                        controller.job_list.clear()
+                    if controller.job_list.paused or self.stopped.is_set():
+                        # the job may have turned the power on after pause or stop
+                        controller.station.power.setOutputOff()
+                elif len(controller.job_list) == 0 and not controller.job_list.paused:
+                    # start failed, nothing to do
+                    controller.stop()
+            except Exception as e:
+                controller.view.show_error(repr(e))
+                controller.stop()
+
+def runStations(model_:model.Model, config:list, file_name:str):
+    """
+    test samples on several benches at the same time, every station writes its own rows to the same report
+    :param config: list of station settings, each is a dictionary:
+                   * osc, power, signal: id or visa address of the instruments
+                   * samples: list of sample number tested on the station
+                   * name (optional): station name
+                   * scale (optional): index of Controller.scale_list, default 0
+                   * spec (optional): spec values, in the order of View.getSpecValue()
+                   * answers (optional): answers of the questions, ex: {"Measure Max. Lock Current?": false}
+                   * interactive (optional): ask the questions on the console
+    """
+    report = ReportSession()
+    report.open(file_name)
+    model_.listDevices()
+    runners = []
+    for i, setting in enumerate(config):
+        station = model_.stations[0] if i == 0 else model_.addStation()
+        station.name = setting.get('name', station.name)
+        model_.connectStation(station, setting['osc'], setting['power'], setting['signal'])
+        headless = view.HeadlessView(station.name, setting.get('spec'), setting.get('answers'),
+                                     interactive=setting.get('interactive', False))
+        controller = Controller(model_, headless, station, report)
+        controller.scale_no = setting.get('scale', 0)
+        runners.append(StationRunner(controller, setting['samples'], file_name))
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    for station in model_.stations:
+        station.osc.waitTransfers()
+    report.close()
+
 class App():
     def __init__(self) -> None:
         parser = argparse.ArgumentParser(description="add command-line arguments")
         parser.add_argument('-d', '--dummy', action='store_true', help='dummy device ids for testing without connecting devices')
         parser.add_argument('-c', '--cprint', action='store_true', help='showing cprint message on GUI')
         parser.add_argument('-s', '--stdout', action='store_true', help='showing stdout message on GUI')
+        parser.add_argument('--stations', type=str, default=None, help='json file of station settings, test on several benches without GUI')
+        parser.add_argument('--simulate', type=int, nargs='?', const=1, default=0, help='use simulated instruments instead of visa devices, optionally the number of benches')
+        parser.add_argument('--latency_scale', type=float, default=1.0, help='multiply the latency of the simulated instruments, 0 for no delay')
+        parser.add_argument('--trace', type=str, default=None, help='trace the instrument I/O and save it to this .json or .csv file at stop')
+        parser.add_argument('--no_plot', action='store_true', help='hide the live waveform and trend plot')
+        parser.add_argument('--log', type=str, default='fan_test.log', help='rotating log file of all messages')
         
         args = parser.parse_args()
+        gui_log.setup(args.log)
         print(args)
-        self._model = model.Model(dummy=args.dummy)
-        self._view = view.View(cprint=args.cprint, stdout=args.stdout, default_filename=self.dir_format())
-        self._controller = Controller(self._model, self._view)
+        if args.trace is not None:
+            tracer.enable(args.trace)
+        if args.simulate:
+            self._model = model.Model(simulate=True, benches=args.simulate, latency_scale=args.latency_scale)
+        else:
+            self._model = model.Model(dummy=args.dummy)
+        self._stations = None
+        if args.stations is not None:
+            with open(args.stations, encoding='utf-8') as f:
+                self._stations = json.load(f)
+            return
+        self._view = view.View(cprint=args.cprint, stdout=args.stdout, default_filename=self.dir_format(), plot=not args.no_plot)
+        self._controller = ControllerThread(Controller(self._model, self._view))
         self._view.set_controller(self._controller)
+        self._model.startDiscovery()
     
     def dir_format(self):
         t = time.localtime()
@@ -305,12 +668,21 @@ class App():
         return ""
 
     def mainloop(self):
+        if self._stations is not None:
+            runStations(self._model, self._stations, self.dir_format() + '.xlsx')
+            return
         while (True):
             # --------- Read and update window --------
-            event, values = self._view.window.read(timeout=1000)
+            # the test sequence runs on the worker, its GUI updates arrive as events
+            event, values = self._view.window.read(timeout=50)
+            self._view.flushLog()
+            if event == self._view.call_key:
+                self._view.handleCall(values[event])
+                continue
             if event != '__TIMEOUT__' and \
                event != '-SEC1_KEY--BUTTON-' and event != '-SEC1_KEY--TITLE-' and \
-               event != '-SEC2_KEY--BUTTON-' and event != '-SEC2_KEY--TITLE-':
+               event != '-SEC2_KEY--BUTTON-' and event != '-SEC2_KEY--TITLE-' and \
+               event != '-SEC3_KEY--BUTTON-' and event != '-SEC3_KEY--TITLE-':
                 print(event)
             # --------- Display updates in window --------
             self._controller.selectDevices()
@@ -320,10 +692,18 @@ class App():
 
             self._view.changeCollapsibleSection(event, self._view.sec1_key)
             self._view.changeCollapsibleSection(event, self._view.sec2_key)
+            self._view.changeCollapsibleSection(event, self._view.sec3_key)
             self._view.fsm(event, values)
-            if self._view.state == self._view.State.Testing:
-                self._controller.runTest()
+            self._view.refreshPlot()
+        # the worker may wait for a popup that the event loop no longer shows
+        self._view.closeCalls()
         self._controller.stop()
+        self._controller.close()
+        self._model.stopDiscovery()
+        # wait for the hard copies to be saved before leaving
+        self._model.osc.waitTransfers()
+        # wait for the report to be saved before leaving
+        self._controller.report.close()
         self._view.window.close()
 
 if __name__ == '__main__':
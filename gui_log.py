@@ -0,0 +1,104 @@
+'''
+Log of the test messages for the GUI.
+
+print() of any thread is copied line by line to the 'fan_test.stdout' logger, the messages of the view go to
+'fan_test.view'. Every record is saved to a rotating log file. GuiLogHandler keeps the latest records in a bounded
+ring, the event loop takes them in batches with drain(), so the window is not redrawn for every line.
+
+Typical usage:
+    gui_log.setup('fan_test.log')
+    handler = gui_log.GuiLogHandler(capacity=2000)
+    gui_log.logger.addHandler(handler)
+    ...
+    for text, color in handler.drain():      # on the GUI thread
+        multiline.print(text, text_color=color)
+'''
+import collections
+import logging
+import logging.handlers
+import sys
+import threading
+
+logger = logging.getLogger('fan_test')
+stdout_logger = logger.getChild('stdout')
+view_logger = logger.getChild('view')
+
+class GuiLogHandler(logging.Handler):
+    '''
+    keep the latest records as tuple(text, color) until the GUI takes them, older records are dropped when full
+    '''
+    def __init__(self, capacity: int = 2000, level: int = logging.INFO):
+        super().__init__(level)
+        self.records = collections.deque(maxlen=capacity)
+        self.dropped = 0 # records dropped since the last drain
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self, record: logging.LogRecord):
+        color = getattr(record, 'color', 'red' if record.levelno >= logging.ERROR else None)
+        try:
+            text = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        # the handler lock is held by handle()
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append((text, color))
+
+    def drain(self):
+        '''
+        take the collected records, a note of the dropped records comes first
+        '''
+        with self.lock:
+            records = list(self.records)
+            self.records.clear()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            records.insert(0, ('... %d lines not shown, see the log file'%dropped, 'gray'))
+        return records
+
+class StdoutLog:
+    '''
+    stdout that writes to the console and logs every complete line, the partial line of each thread is kept apart
+    '''
+    def __init__(self, stream, log: logging.Logger = stdout_logger):
+        self.stream = stream
+        self.log = log
+        self.lines = dict() # key: thread id, value: partial line
+        self.lock = threading.Lock()
+
+    def write(self, text: str):
+        if self.stream is not None:
+            self.stream.write(text)
+        with self.lock:
+            key = threading.get_ident()
+            lines = (self.lines.pop(key, '') + text).split('\n')
+            if lines[-1]:
+                self.lines[key] = lines[-1]
+        for line in lines[:-1]:
+            self.log.info(line)
+        return len(text)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def setup(file_name: str = 'fan_test.log', max_bytes: int = 5 * 1024 * 1024, backup_count: int = 5):
+    '''
+    save the log to a rotating file and copy print() to the log
+    Args:
+        file_name (str): log file, None for no file
+        max_bytes (int): size of a file before it is rotated
+        backup_count (int): number of rotated files kept
+    '''
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if file_name is not None:
+        handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+    if not isinstance(sys.stdout, StdoutLog):
+        sys.stdout = StdoutLog(sys.stdout)
@@ -0,0 +1,137 @@
+'''
+Log writer shared by the logging scripts (read_counter_data.py, read_oscilloscope_data.py).
+
+Keeps the file open, collects the rows in memory and writes them when flush_rows rows are collected or
+flush_time seconds have passed, and starts a new file every hour or day if rotate is set.
+The rows are written as CSV, or as fixed size binary records ('bin') with a .json file describing the columns,
+which can be memory-mapped by numpy without parsing:
+    data = log_writer.load('counter_data_0.bin')    # numpy structured array, data['Timestamp'], data['Data']
+
+Typical usage:
+    with LogWriter('counter_data_0.csv', ['Timestamp', 'Data'], rotate='day') as writer:
+        writer.write([value])
+'''
+import csv
+import datetime
+import json
+import os
+import time
+import numpy as np # http://www.numpy.org/
+
+ROTATE_FORMAT = {None: None, 'hour': '%Y%m%d_%H', 'day': '%Y%m%d'}
+
+class LogWriter:
+    def __init__(self, filename: str, header: list, rotate: str = None, format: str = 'csv', dtypes: list = None,
+                 digits: int = 0, flush_rows: int = 1000, flush_time: float = 1.0):
+        '''
+        Args:
+            filename (str): Name of the log file, with rotate the period is added before the extension,
+                            ex: counter_data_0_20250101.csv, the extension is changed to .bin for binary format
+            header (list): column names, the first one is the timestamp
+            rotate (str): None, 'hour' or 'day'
+            format (str): 'csv' or 'bin'
+            dtypes (list): numpy type of the columns after the timestamp for binary format, ex: ['u8'], default 'f8'
+            digits (int): digits of the fraction of seconds in the csv timestamp
+            flush_rows (int): write to disk when this number of rows are collected
+            flush_time (float): write to disk when this seconds have passed since the last write
+        '''
+        if rotate not in ROTATE_FORMAT:
+            raise ValueError('rotate should be one of %s'%list(ROTATE_FORMAT))
+        if format not in ('csv', 'bin'):
+            raise ValueError('format should be csv or bin')
+        self.base, ext = os.path.splitext(filename)
+        self.ext = '.bin' if format == 'bin' else (ext or '.csv')
+        self.header = list(header)
+        self.rotate = rotate
+        self.format = format
+        self.digits = digits
+        self.flush_rows = flush_rows
+        self.flush_time = flush_time
+        # timestamp in nanoseconds since epoch, the other columns as given
+        self.dtype = np.dtype([(self.header[0], '<i8')] +
+                              [(name, '<' + (dtypes[i] if dtypes else 'f8')) for i, name in enumerate(self.header[1:])])
+        self.rows = list()
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.filename = None
+        self.period = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def periodName(self, timestamp: float):
+        fmt = ROTATE_FORMAT[self.rotate]
+        return None if fmt is None else time.strftime(fmt, time.localtime(timestamp))
+
+    def open(self, period: str):
+        self.close()
+        self.period = period
+        self.filename = self.base + ('' if period is None else '_' + period) + self.ext
+        if self.format == 'bin':
+            self.file = open(self.filename, 'ab')
+            if self.file.tell() == 0:
+                with open(self.filename + '.json', 'w', encoding='utf-8') as f:
+                    json.dump({'columns': self.dtype.names, 'dtype': self.dtype.descr, 'timestamp': 'ns since epoch'}, f)
+        else:
+            self.file = open(self.filename, 'a', newline='')
+            if self.file.tell() == 0:
+                csv.writer(self.file).writerow(self.header)
+
+    def write(self, values: list, timestamp: float = None):
+        '''
+        collect a row, values are the columns after the timestamp
+        Args:
+            timestamp (float): seconds since epoch, default now
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        period = self.periodName(timestamp)
+        if self.file is None or period != self.period:
+            self.flush()
+            self.open(period)
+        self.rows.append((timestamp, values))
+        if len(self.rows) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_time:
+            self.flush()
+
+    def formatTime(self, timestamp: float):
+        text = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
+        return text[:-7] if self.digits == 0 else text[:-6 + self.digits]
+
+    def flush(self):
+        ''' write the collected rows to disk '''
+        self.last_flush = time.monotonic()
+        if not self.rows or self.file is None:
+            return
+        if self.format == 'bin':
+            records = np.empty(len(self.rows), dtype=self.dtype)
+            records[self.header[0]] = [int(t * 1e9) for t, _ in self.rows]
+            for i, name in enumerate(self.header[1:]):
+                records[name] = [values[i] for _, values in self.rows]
+            self.file.write(records.tobytes())
+        else:
+            csv.writer(self.file).writerows([self.formatTime(t)] + list(values) for t, values in self.rows)
+        self.file.flush()
+        self.rows.clear()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+def load(filename: str, mmap: bool = True):
+    '''
+    read a binary log written by LogWriter as numpy structured array, memory-mapped if mmap
+    '''
+    with open(filename + '.json', encoding='utf-8') as f:
+        meta = json.load(f)
+    dtype = np.dtype([tuple(field) for field in meta['dtype']])
+    if mmap:
+        if os.path.getsize(filename) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r')
+    return np.fromfile(filename, dtype=dtype)
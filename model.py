@@ -7,14 +7,22 @@
 
 from ast import Tuple
 import time
-from typing import Literal
+from typing import Dict, Literal
 import warnings # std module
 import pyvisa as visa # http://github.com/hgrecco/pyvisa
 import matplotlib.pyplot as plt # http://matplotlib.org/
 import numpy as np # http://www.numpy.org/
+import waveform
+from tracing import tracer
 from enum import Enum
 import openpyxl
+import itertools
+import collections
 import os
+import queue
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from math import floor, log
 
 class TypeEnum(Enum):
@@ -22,17 +30,195 @@ class TypeEnum(Enum):
     power = 1
     signal = 2
 
+class InstrumentSession:
+    """
+    Wrap the visa resource of an instrument, every I/O holds the lock of the instrument,
+    so the commands queued on the instrument worker and the test sequence never interleave on the bus.
+    Other attributes (timeout, termination, clear(), close()...) are passed to the resource.
+    The I/O is reported to tracing.tracer when it is enabled.
+    Between begin() and end() the writes are collected and sent as compound messages of at most buffer_limit characters.
+    """
+    def __init__(self, resource:visa.resources.Resource, lock:threading.RLock, name:str = '', buffer_limit:int = 256):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'lock', lock)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'buffer_limit', buffer_limit)
+        object.__setattr__(self, 'pending', None) # batched commands, None if not batching
+        object.__setattr__(self, 'sent', 0) # number of batched commands sent
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resource, name, value)
+
+    def begin(self):
+        object.__setattr__(self, 'pending', [])
+
+    def end(self):
+        try:
+            self.flush()
+        finally:
+            object.__setattr__(self, 'pending', None)
+
+    def flush(self):
+        """
+        send the batched commands joined by ';:', the leading ':' resets the header path of each command
+        """
+        if not self.pending:
+            return
+        message = ';:'.join(command.strip().lstrip(':') for command in self.pending)
+        object.__setattr__(self, 'sent', self.sent + len(self.pending))
+        self.pending.clear()
+        self._write(message)
+
+    def write(self, message:str):
+        with self.lock:
+            if self.pending is None:
+                return self._write(message)
+            size = sum(len(command) + 2 for command in self.pending)
+            if self.pending and size + len(message) > self.buffer_limit:
+                self.flush()
+            self.pending.append(message)
+            return len(message)
+
+    def _write(self, message:str):
+        with self.lock:
+            if not tracer.enabled:
+                return self.resource.write(message)
+            start = time.perf_counter()
+            res = self.resource.write(message)
+            tracer.record(self.name, 'write', message, len(message), start)
+            return res
+
+    def query(self, message:str):
+        with self.lock:
+            self.flush()
+            if not tracer.enabled:
+                return self.resource.query(message)
+            start = time.perf_counter()
+            res = self.resource.query(message)
+            tracer.record(self.name, 'query', message, len(message) + len(res), start)
+            return res
+
+    def read_raw(self, *args):
+        with self.lock:
+            self.flush()
+            if not tracer.enabled:
+                return self.resource.read_raw(*args)
+            start = time.perf_counter()
+            res = self.resource.read_raw(*args)
+            tracer.record(self.name, 'read_raw', 'read_raw', len(res), start)
+            return res
+
+    def query_binary_values(self, message:str, **kwargs):
+        with self.lock:
+            self.flush()
+            if not tracer.enabled:
+                return self.resource.query_binary_values(message, **kwargs)
+            start = time.perf_counter()
+            res = self.resource.query_binary_values(message, **kwargs)
+            tracer.record(self.name, 'binary', message, getattr(res, 'nbytes', len(res)), start)
+            return res
+
+def waitAll(futures):
+    """
+    join point of commands submitted to instrument workers, return the results in order
+    and raise the first exception of the commands
+    """
+    return [future.result() for future in futures]
+
 class Instrument:
     """
     a template class to store instrument information and common base attribute using VISA resource.
     list: For gui update. Stores all instrument's id of these class that connect to PC.
     boolean update: notation for gui to update
     """
+    buffer_limit = 256 # characters of a batched compound message, within the input buffer of the instrument
+
     def __init__(self):
         self.update = False
         self.list_id = list()
         self.id: str
-        self.scope: visa.resources.Resource
+        self.scope: InstrumentSession
+        self.lock = threading.RLock()
+        self.worker = None
+        self.shadow = dict() # last written settings, key: setting name, value: setting value
+
+    def connect(self, resource:visa.resources.Resource):
+        """
+        use the opened visa resource through an InstrumentSession and set up the instrument
+        """
+        self.scope = InstrumentSession(resource, self.lock, type(self).__name__, self.buffer_limit)
+        self.invalidate()
+        self.setScope()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        queue the command on the worker thread of this instrument and return a future,
+        commands of the same instrument run in order, commands of different instruments run at the same time
+        """
+        if self.worker is None:
+            self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+        return self.worker.submit(self._run, tracer.currentJob(), fn, *args, **kwargs)
+
+    @contextlib.contextmanager
+    def batch(self, sync:bool = False):
+        """
+        collect the writes in the block and send them as few compound messages, the bus is held for the whole block.
+        A query in the block sends the collected writes first.
+        :param sync: wait for the instrument to finish the commands with one *OPC? at the end, if any command is sent
+        """
+        with self.lock:
+            if self.batching():
+                # nested batch is part of the outer one
+                yield
+                return
+            sent = self.scope.sent
+            self.scope.begin()
+            try:
+                try:
+                    yield
+                finally:
+                    self.scope.end()
+            except Exception:
+                # the batched writes may be dropped, the cache may hold settings the instrument never got
+                self.invalidate()
+                raise
+            if sync and self.scope.sent != sent:
+                self.scope.query("*OPC?")
+
+    def batching(self):
+        return self.scope.pending is not None
+
+    def setting(self, key, value, command:str, force:bool = False):
+        """
+        write-through cache of the instrument settings, the command is sent only if the value differs from the last written one.
+        In a batch the cache is updated when the command is queued, batch() forgets the cache if the batch fails.
+        :param key: setting name, ex: ('scale', Channel.current)
+        :param force: send the command even if the value is unchanged
+        :return: True if the command is sent
+        """
+        with self.lock:
+            if not force and key in self.shadow and self.shadow[key] == value:
+                return False
+            self.scope.write(command)
+            self.shadow[key] = value
+            return True
+
+    def invalidate(self):
+        """
+        forget the cached settings, ex: after reset, reconnect or changed on the front panel
+        """
+        with self.lock:
+            self.shadow.clear()
+
+    def _run(self, job, fn, *args, **kwargs):
+        # the I/O on the worker is traced as part of the job that submitted it
+        tracer.setJob(job)
+        # hold the bus for the whole command, ex: write then read_raw
+        with self.lock:
+            return fn(*args, **kwargs)
     
     def printStartMsg(self, msg:str):
         """
@@ -43,6 +229,7 @@ class Instrument:
         print(msg)
 
     def reset(self):
+        self.invalidate()
         self.scope.write('*rst') # reset
         t1 = time.perf_counter()
         r = self.scope.query('*opc?') # sync
@@ -61,6 +248,200 @@ class Instrument:
         """
         pass
 
+class ReportSession:
+    """
+    Keep one parsed report workbook in memory for the whole test run.
+    Cell writes are collected in memory and applied to the workbook by a background thread,
+    which saves the file when flushed, so the measurement steps never block on openpyxl I/O.
+    """
+    template = '風扇樣品檢驗報告(for RD).xlsx'
+
+    def __init__(self, template:str = template):
+        self.template_file = template
+        self.file_name = None
+        self.wb = None
+        self.values = dict()
+        """
+        dictionary, the in memory view of the active sheet
+        * key: cell coordinate, ex: 'H11'
+        * value: cell value
+        """
+        self.pending = dict()
+        """
+        dictionary of cell writes not yet applied to the workbook
+        * key: cell coordinate
+        * value: cell value
+        """
+        self.save_time = 0.0 # accumulated seconds spent in wb.save()
+        self._cond = threading.Condition()
+        self._flush_request = 0 # number of flush requested
+        self._flush_done = 0 # number of flush finished by saver thread
+        self._closing = False
+        self._saver = None
+        self._template_wb = None
+        self._template_loader = None
+        self.prepareTemplate()
+
+    def prepareTemplate(self):
+        """
+        parse the blank report template in background, so that a new report is ready without disk I/O when needed
+        """
+        if self._template_wb is not None or self._template_loader is not None:
+            return
+        if not os.path.exists(self.template_file):
+            return
+        def load():
+            try:
+                self._template_wb = openpyxl.load_workbook(self.template_file)
+            except Exception as e:
+                print(f"An error occurred when loading template: {e}")
+        self._template_loader = threading.Thread(target=load, name='report template', daemon=True)
+        self._template_loader.start()
+
+    def takeTemplate(self):
+        """
+        return the parsed template as a blank report, and start parsing another copy for the next report
+        """
+        if self._template_loader is not None:
+            self._template_loader.join()
+            self._template_loader = None
+        wb = self._template_wb
+        self._template_wb = None
+        if wb is None:
+            wb = openpyxl.load_workbook(self.template_file)
+        self.prepareTemplate()
+        return wb
+
+    def open(self, new_file_name:str):
+        """
+        open the current editing report, if not created yet, use the template as blank report, and create specified directory.
+        The workbook is parsed once and kept until another report is opened or the session is closed.
+        """
+        if self.wb is not None and new_file_name == self.file_name:
+            return
+        self.close()
+        if os.path.exists(new_file_name):
+            wb = openpyxl.load_workbook(new_file_name)
+        else:
+            #  Create the directory with error handling
+            try:
+                dir = os.path.dirname(new_file_name)
+                os.makedirs(dir)
+                print(f"Directory '{dir}' created successfully")
+            except FileExistsError:
+                print(f"Directory '{dir}' already exists")
+            except Exception as e:
+                print(f"An error occurred: {e}")
+            wb = self.takeTemplate()
+
+        sheet = wb.active
+        with self._cond:
+            self.wb = wb
+            self.file_name = new_file_name
+            self.values = {cell.coordinate: cell.value for row in sheet.iter_rows() for cell in row if cell.value is not None}
+            self.pending.clear()
+            self._closing = False
+        self._saver = threading.Thread(target=self._saveLoop, name='report saver', daemon=True)
+        self._saver.start()
+
+    def read(self, cell:str):
+        """
+        return the value of the cell on the active sheet, including writes that are not saved yet
+        """
+        with self._cond:
+            return self.values.get(cell)
+
+    def write(self, cell:str, value, overwrite:bool = False):
+        """
+        write value into the cell of the active sheet in memory, the workbook is saved on next flush
+        :param overwrite: if false, only write when the cell is empty,
+                          incase the cell has already written on previous step before resuming from pause
+        :return: true if the value is written
+        """
+        with self._cond:
+            if self.wb is None:
+                warnings.warn('report is not opened, %s is not saved'%cell)
+                return False
+            if not overwrite and self.values.get(cell) is not None:
+                return False
+            self.values[cell] = value
+            self.pending[cell] = value
+            return True
+
+    def dirty(self):
+        with self._cond:
+            return len(self.pending) > 0
+
+    def flush(self, wait:bool = False):
+        """
+        ask the saver thread to save the workbook if there is any unsaved write
+        :param wait: block until the saving is finished
+        """
+        with self._cond:
+            if self._saver is None:
+                return
+            if self.pending:
+                self._flush_request += 1
+                self._cond.notify_all()
+            if wait:
+                target = self._flush_request
+                self._cond.wait_for(lambda: self._flush_done >= target or not self._saver.is_alive())
+
+    def close(self):
+        """
+        save unsaved writes, stop the saver thread and release the workbook
+        """
+        if self._saver is None:
+            return
+        self.flush(wait=True)
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._saver.join()
+        self._saver = None
+        self.wb.close()
+        self.wb = None
+
+    def _saveLoop(self):
+        """
+        background thread, the only place touching the workbook after it is opened
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._flush_request > self._flush_done or self._closing)
+                if self._flush_request <= self._flush_done and self._closing:
+                    return
+                target = self._flush_request
+                writes = self.pending
+                self.pending = dict()
+            try:
+                sheet = self.wb.active
+                for cell, value in writes.items():
+                    sheet[cell] = value
+                t1 = time.perf_counter()
+                self.wb.save(self.file_name)
+                self.save_time += time.perf_counter() - t1
+            except Exception as e:
+                # ex: report is opened by excel, keep the writes for next flush
+                print(f"An error occurred when saving report: {e}")
+                with self._cond:
+                    writes.update(self.pending)
+                    self.pending = writes
+            with self._cond:
+                self._flush_done = target
+                self._cond.notify_all()
+
+class Station:
+    """
+    One test bench, a set of oscilloscope, power supply and signal generator wired to one fan.
+    Several stations can run their own test sequence at the same time.
+    """
+    def __init__(self, name:str = 'station 1'):
+        self.name = name
+        self.osc = Oscilloscope()
+        self.power = PowerSupply()
+        self.signal = SignalGenerator()
+
 class Model:
     """
     Save different script of test steps.
@@ -73,13 +454,19 @@ class Model:
             self.type = num
             self.id = id
 
-    def __init__(self, dummy:bool = False) -> None:
+    def __init__(self, dummy:bool = False, simulate:bool = False, **sim_options) -> None:
         '''
         Parameters
         ----------
         dummy : for testing, without device connected
+        simulate : use the simulated instruments of simulator.py instead of visa devices
+        sim_options : keyword arguments of simulator.ResourceManager, ex: benches=2, latency_scale=0
         '''
-        self.rm = visa.ResourceManager()
+        if simulate:
+            import simulator
+            self.rm = simulator.ResourceManager(**sim_options)
+        else:
+            self.rm = visa.ResourceManager()
         self.inst_dict = dict()
         """
         dictionary
@@ -92,17 +479,38 @@ class Model:
         * key: id
         * value: visa address
         """
-        self.osc = Oscilloscope()
-        self.power = PowerSupply()
-        self.signal = SignalGenerator()
+        self.stations = [Station()]
+        # instruments of the first station, the GUI lists all found instruments on them
+        self.osc = self.stations[0].osc
+        self.power = self.stations[0].power
+        self.signal = self.stations[0].signal
         self.dummy = dummy
+        self.idn_cache = dict()
+        """
+        dictionary, the *IDN? answer of every address ever scanned
+        * key: visa address
+        * value: id
+        """
+        self.scanned = set() # visa address found on last scan
+        self.events = queue.Queue() # device ('add' | 'remove', visa address, id) events for GUI
+        self.discovery = None
+        self.discovery_stop = threading.Event()
+        self.discovery_paused = threading.Event() # set while a test is running, see pauseDiscovery()
+        self.discovery_lock = threading.Lock() # held by the scan in progress
 
     def listDevices(self):
         """Run to map different devices with their address and names.
-        Categorize the model by detecting matched key word, update the following attribute:
-        * list_id: corresponding instrument class (for GUI)
-        * inst_dict: memorize the visa address and its id and type
-        * id_dict: if user select instrument from GUI, this dictionary memorize its address
+        Scan the visa resources once and apply the add/remove events right away, for scripts without GUI.
+        """
+        self.scanDevices()
+        self.applyDeviceEvents()
+
+    def scanDevices(self):
+        """
+        Diff the visa resource list against the last scan and publish ('add', visa address, id) or
+        ('remove', visa address, id) to self.events.
+        The id of a new address is asked through *IDN? only once and kept in self.idn_cache,
+        so it is safe to be called periodically from the discovery thread.
         """
         # Currently use case:
         # 3 instrument are connected to PC via USB, which are power supply, signal generator,
@@ -124,13 +532,42 @@ class Model:
         # visa_address = 'USB0::0x1698::0x0837::001000005648::INSTR'
         # signal generator idn: TEKTRONIX,AFG31052,C013019,SCPI:99.0 FV:1.5.2
         # visa_address = 'USB0::0x0699::0x0358::C013019::INSTR'
-            
+
         for visa_add in info:
-            if self.inst_dict and visa_add in self.inst_dict: 
+            if visa_add in self.scanned:
                 continue
             # new device detected
             try:
-                scopename = self.getScopeName(visa_add)
+                if visa_add not in self.idn_cache:
+                    self.idn_cache[visa_add] = self.getScopeName(visa_add)
+                self.scanned.add(visa_add)
+                self.events.put(('add', visa_add, self.idn_cache[visa_add]))
+            except visa.VisaIOError:
+                print("No instrument found: " + visa_add)
+            except:
+                print("Error Communicating with %s"%visa_add)
+
+        # delete disconnected instrument, iterate over a copy of the scanned set
+        for old_address in list(self.scanned):
+            if old_address not in info:
+                self.scanned.discard(old_address)
+                self.events.put(('remove', old_address, self.idn_cache[old_address]))
+
+    def applyDeviceEvents(self):
+        """
+        Consume the events of self.events and categorize the model by detecting matched key word, update the following attribute:
+        * list_id: corresponding instrument class (for GUI)
+        * inst_dict: memorize the visa address and its id and type
+        * id_dict: if user select instrument from GUI, this dictionary memorize its address
+        """
+        while True:
+            try:
+                action, visa_add, scopename = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if action == 'add':
+                if visa_add in self.inst_dict:
+                    continue
                 self.id_dict[scopename] = visa_add
                 if '62012P' in scopename:
                     self.inst_dict[visa_add] = self.DictValue(TypeEnum.power, scopename)
@@ -146,35 +583,62 @@ class Model:
                     self.osc.update = True
                 else:
                     print("Please check new device: " + scopename)
-                    self.inst_dict[visa_add] = 'unknown'
-            except visa.VisaIOError:
-                print("No instrument found: " + visa_add)
-            except:
-                print("Error Communicating with %s"%visa_add)
+                    self.inst_dict[visa_add] = self.DictValue(None, scopename)
+            elif action == 'remove':
+                if visa_add not in self.inst_dict:
+                    continue
+                id = self.inst_dict[visa_add].id
+                self.id_dict.pop(id, None)
+                # find the corresponding instrument and remove it from the corresponding list_id
+                if self.inst_dict[visa_add].type == TypeEnum.osc:
+                    self.osc.update = True
+                    self.osc.list_id.remove(id)
+                elif self.inst_dict[visa_add].type == TypeEnum.power:
+                    self.power.update = True
+                    self.power.list_id.remove(id)
+                elif self.inst_dict[visa_add].type == TypeEnum.signal:
+                    self.signal.update = True
+                    self.signal.list_id.remove(id)
+                else:
+                    print("unspecified instrument type.")
+                self.inst_dict.pop(visa_add)
+
+    def startDiscovery(self, interval:float = 1.0):
+        """
+        start a background thread scanning the visa resources every interval seconds,
+        call applyDeviceEvents() from the GUI loop to take the changes
+        """
+        if self.discovery is not None:
+            return
+        self.discovery_stop.clear()
+        def discover():
+            while not self.discovery_stop.is_set():
+                with self.discovery_lock:
+                    if not self.discovery_paused.is_set():
+                        self.scanDevices()
+                self.discovery_stop.wait(interval)
+        self.discovery = threading.Thread(target=discover, name='device discovery', daemon=True)
+        self.discovery.start()
+
+    def pauseDiscovery(self):
+        """
+        skip the scans while a test is running, the *IDN? of a new address would interleave with the test commands
+        on a shared bus. Return after the scan in progress.
+        """
+        self.discovery_paused.set()
+        with self.discovery_lock:
+            pass
+
+    def resumeDiscovery(self):
+        self.discovery_paused.clear()
+
+    def stopDiscovery(self):
+        if self.discovery is None:
+            return
+        self.discovery_stop.set()
+        self.discovery.join()
+        self.discovery = None
 
-        # delete disconnected instrument
-        if (self.inst_dict):
-            for old_address in self.inst_dict.keys():
-            # todo: fix RuntimeError: dictionary changed size during iteration
-            # after unplugging usb
-                if old_address not in info:
-                    id = self.inst_dict[old_address].id
-                    self.id_dict.pop(id)
-                    # find the corresponding instrument and remove it from the corresponding list_id
-                    if self.inst_dict[old_address].type == TypeEnum.osc:
-                        self.osc.update = True
-                        self.osc.list_id.remove(id)
-                    elif self.inst_dict[old_address].type == TypeEnum.power:
-                        self.power.update = True
-                        self.power.list_id.remove(id)
-                    elif self.inst_dict[old_address].type == TypeEnum.signal:
-                        self.signal.update = True
-                        self.signal.list_id.remove(id)
-                    else:
-                        print("unspecified instrument type.")
-                    self.inst_dict.pop(old_address)
-        return
-    
     def getScopeName(self, visa_add:str):
         """
         open visa address as resource and ask the id of that instrument, close the used resource and return the instrument id
@@ -201,14 +665,28 @@ class Model:
         connect selected devices and call open_resource to enable communication
         """
         try:
-            inst.scope = self.rm.open_resource(visa_add)
-            inst.setScope()
+            inst.connect(self.rm.open_resource(visa_add))
             return True
         except visa.VisaIOError:
             raise ValueError("No instrument found: " + visa_add)
         except:
             raise ValueError("Error Communicating with" + visa_add)
 
+    def addStation(self, name:str = None):
+        """
+        add another test bench, return the new station
+        """
+        station = Station(name if name is not None else 'station %d'%(len(self.stations) + 1))
+        self.stations.append(station)
+        return station
+
+    def connectStation(self, station:Station, osc:str, power:str, signal:str):
+        """
+        connect the instruments of the station, each instrument is given by its id or visa address
+        """
+        for inst, name in ((station.osc, osc), (station.power, power), (station.signal, signal)):
+            self.connectDevice(self.id_dict.get(name, name), inst)
+
     def autosetSingleCurvePlot(self):
         self.connectDevice('USB0::0x0699::0x0527::C033493::INSTR') # test single function through hard coded visa address
         self.osc.autoset()
@@ -225,8 +703,8 @@ class Model:
 
     def outputAllChannelSignal(self):
         self.connectDevice('USB0::0x0699::0x0527::C033493::INSTR') # test single function through hard coded visa address
-        self.osc.saveHardcopy('hardcopy')
-        self.osc.saveWaveform('waveform')
+        self.osc.saveHardcopy('hardcopy', wait=True)
+        self.osc.saveWaveform('waveform', wait=True)
         self.osc.errorChecking()
         self.osc.scope.close()
 
@@ -252,9 +730,17 @@ class Model:
         self.signal.scope.close()
 
 class Oscilloscope(Instrument):
+    buffer_limit = 1024
+
     def __init__(self):
         super().__init__()
         self.measure = {}
+        self.transfer_worker = None
+        self.transfers = list() # futures of queued file transfer
+        self.temp_count = itertools.count()
+        self.srq_handler = None # installed service request handler
+        self.srq_available = True # False if the VISA backend does not support service request
+        self.sequence_complete = threading.Event() # set by the service request of a finished single sequence
     
     def setScope(self):
         self.scope.timeout = 10000 # ms
@@ -268,6 +754,7 @@ class Oscilloscope(Instrument):
         """)
 
     def autoset(self):
+        self.invalidate() # autoset changes scales and trigger
         self.scope.write('autoset EXECUTE') # autoset
         t3 = time.perf_counter()
         r = self.scope.query('*opc?') # sync
@@ -298,13 +785,67 @@ class Oscilloscope(Instrument):
         t6 = time.perf_counter()
         print('acquire time: {} s'.format(t6 - t5))
 
+    def runContinuous(self):
+        '''
+        run the acquisition continuously, the single sequence of acqConfig() or a max current step leaves stopafter SEQUENCE
+        '''
+        self.scope.write('acquire:stopafter RUNSTop;:acquire:state 1')
+
     # data query
-    def dataQuery(self):
+    def dataQuery(self, chunk:int = 1000000):
         t7 = time.perf_counter()
-        self.bin_wave = self.scope.query_binary_values('curve?', datatype='b', container=np.array)
+        self.bin_wave = self.chunkedCurve(np.empty(self.record, dtype=np.int8), chunk)
         t8 = time.perf_counter()
         print('transfer time: {} s'.format(t8 - t7))
 
+    def chunkedCurve(self, out:np.ndarray, chunk:int = 1000000):
+        '''
+        query the curve of the data source window by window into a preallocated buffer,
+        each window is small enough for the scope timeout and no full-size temporary array is created
+        Args:
+            out (np.ndarray): int8 (byt_n 1) or int16 (byt_n 2) buffer of the record length, can be np.memmap
+            chunk (int): samples per query
+        '''
+        datatype = 'b' if out.dtype.itemsize == 1 else 'h'
+        for start in range(0, len(out), chunk):
+            stop = min(start + chunk, len(out))
+            out[start:stop] = self.scope.query_binary_values('data:start %d;:data:stop %d;:curve?'%(start + 1, stop),
+                                                             datatype=datatype, is_big_endian=False, container=np.array)
+        # restore the window of the full record
+        self.scope.write('data:start 1;:data:stop %d'%len(out))
+        return out
+
+    def transferCurve(self, channel:'Oscilloscope.Channel', file_name:str = None, width:int = 1, chunk:int = 1000000):
+        '''
+        transfer a long record of the channel in windows, the scaling is applied lazily by waveform.Record
+        Args:
+            channel (Channel): the channel to transfer
+            file_name (str): if given, the buffer is a memory-mapped .npy file with .json scaling factors (without extension)
+            width (int): bytes per sample, 1 or 2
+            chunk (int): samples per query
+        Returns:
+            waveform.Record: unscaled int8/int16 levels and the scaling factors
+        '''
+        self.scope.write('header 0')
+        self.scope.write('data:encdg SRIBINARY')
+        self.scope.write('wfmoutpre:byt_n %d'%width)
+        length = int(self.scope.query('horizontal:recordlength?'))
+        res = self.scope.query('data:source CH%d;:wfmoutpre:xincr?;:wfmoutpre:xzero?;:wfmoutpre:ymult?;'%channel.value +
+                               ':wfmoutpre:yzero?;:wfmoutpre:yoff?;:wfmoutpre:yunit?').strip().split(';')
+        dtype = np.int8 if width == 1 else np.int16
+        if file_name is not None:
+            out = np.lib.format.open_memmap(file_name + '.npy', mode='w+', dtype=dtype, shape=(length,))
+        else:
+            out = np.empty(length, dtype=dtype)
+        record = waveform.Record(out, *[float(r) for r in res[:5]], yunit=res[5])
+        t1 = time.perf_counter()
+        self.chunkedCurve(out, chunk)
+        print('transfer time: {} s'.format(time.perf_counter() - t1))
+        if file_name is not None:
+            out.flush()
+            record.save_metadata(file_name)
+        return record
+
     # retrieve scaling factors
     def retrieveAcqSetting(self):
         self.tscale = float(self.scope.query('wfmoutpre:xincr?'))
@@ -333,67 +874,121 @@ class Oscilloscope(Instrument):
         plt.show()
 
     #save curve data in .csv format
-    def saveCurve(self, file_name):
-        f = open(file_name + '.csv', 'w')
-        f.write('s' + ',' + self.yunit + '\n')
-        for i in range(self.record):
-            f.write(str(self.scaled_time[i]) + ',' + str(self.scaled_wave[i]) + '\n')
-        f.close()
+    def waveformRecord(self):
+        '''
+        the last transferred curve (dataQuery) with its scaling factors (retrieveAcqSetting)
+        '''
+        return waveform.Record(self.bin_wave, self.tscale, self.tstart, self.vscale, self.voff, self.vpos, self.yunit)
+
+    def saveCurve(self, file_name, format:Literal['csv', 'npy', 'npz'] = 'csv'):
+        '''
+        save the last transferred curve
+        :param format: 'csv' time and value columns as text
+                       'npy' unscaled levels with .json scaling factors, can be memory-mapped by waveform.Record.load()
+                       'npz' compressed levels and scaling factors in one file
+        '''
+        record = self.waveformRecord()
+        if format == 'csv':
+            record.save_csv(file_name)
+        elif format == 'npy':
+            record.save_npy(file_name)
+        elif format == 'npz':
+            record.save_npz(file_name)
+        else:
+            warnings.warn('saveCurve: wrong format: %s'%format)
     
-    def saveHardcopy(self, file_name):
-        # Save image on scope harddrive
-        self.scope.write('SAVE:IMAGE \'c:/TEMP.PNG\'')
+    def saveHardcopy(self, file_name, wait:bool = False):
+        '''
+        save the screen image on the oscilloscope harddrive, reading it back to PC is queued to the transfer worker
+        :param wait: block until the image is saved on PC
+        :return: future of the transfer
+        '''
+        # Save image on scope harddrive, unique file name so the previous image can still be draining
+        scope_file = self.tempFileName('PNG')
+        self.scope.write('SAVE:IMAGE \'%s\''%scope_file)
         self.scope.query("*OPC?")  #Make sure the image has been saved before trying to read the file
+        future = self.queueTransfer(scope_file, file_name + '.png')
+        if wait:
+            future.result()
+        return future
 
-        # Read file data over
-        self.scope.write('FILESYSTEM:READFILE \'c:/TEMP.PNG\'')
-        try:
-            data = self.scope.read_raw() # return byte data
-        except visa.VisaIOError as e:
-            print("There was a visa error with the following message: {0} ".format(repr(e)))
-            print("Oscilloscope Error Status Register is: "+str(self.scope.query("*ESR?")))
-            print(self.scope.query("ALLEV?"))
+    def saveWaveform(self, file_name, wait:bool = False):
+        '''
+        save all waveform as csv on the oscilloscope harddrive, reading it back to PC is queued to the transfer worker
+        :param wait: block until the file is saved on PC
+        :return: future of the transfer
+        '''
+        scope_file = self.tempFileName('CSV')
+        self.scope.write('SAVe:WAVEform ALL,\'%s\''%scope_file)
+        self.scope.query("*OPC?")
+        # _ALL will be added automatically
+        future = self.queueTransfer(scope_file.replace('.CSV', '_ALL.CSV'), file_name + '.csv')
+        if wait:
+            future.result()
+        return future
+
+    def tempFileName(self, ext:str):
+        '''
+        unique temporary file name on the oscilloscope harddrive
+        '''
+        return 'c:/TEMP_%d_%d.%s'%(os.getpid(), next(self.temp_count), ext)
+
+    def queueTransfer(self, scope_file:str, local_file:str) -> Future:
+        '''
+        queue reading the file of the oscilloscope harddrive to the transfer worker
+        '''
+        if self.transfer_worker is None:
+            self.transfer_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transfer')
+        future = self.transfer_worker.submit(self.readFile, scope_file, local_file)
+        # keep the failed transfers for waitTransfers()
+        self.transfers = [f for f in self.transfers if not f.done() or f.exception() is not None] + [future]
+        return future
+
+    def waitTransfers(self):
+        '''
+        block until all queued files are saved on PC
+        '''
+        transfers, self.transfers = self.transfers, []
+        for future in transfers:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"An error occurred when reading file from oscilloscope: {e}")
+
+    def readFile(self, scope_file:str, local_file:str):
+        '''
+        read the file of the oscilloscope harddrive, delete it and save it to PC,
+        the bus is only held while reading, so the test sequence goes on while the file is written to disk
+        '''
+        with self.lock:
+            # Read file data over
+            self.scope.write('FILESYSTEM:READFILE \'%s\''%scope_file)
+            try:
+                data = self.scope.read_raw() # return byte data
+            except visa.VisaIOError as e:
+                print("There was a visa error with the following message: {0} ".format(repr(e)))
+                print("Oscilloscope Error Status Register is: "+str(self.scope.query("*ESR?")))
+                print(self.scope.query("ALLEV?"))
+                # the future of the transfer fails, waitTransfers() reports it
+                raise
+            finally:
+                # delete the temporary file of the Oscilloscope when this is done as well. 
+                self.scope.write('FILESystem:DELEte \'%s\''%scope_file)
 
         # Save file to local PC
-        if not os.path.exists(file_name):
+        dir = os.path.dirname(local_file)
+        if dir and not os.path.exists(dir):
             #  Create the directory with error handling
             try:
-                dir = os.path.dirname(file_name)
                 os.makedirs(dir)
                 print(f"Directory '{dir}' created successfully")
             except FileExistsError:
                 pass
             except Exception as e:
                 print(f"An error occurred: {e}")
-        
-        fid = open(file_name + '.png', 'wb')
-        fid.write(data)
-        fid.close()
-
-        # delete the temporary image file of the Oscilloscope when this is done as well. 
-        self.scope.write('FILESystem:DELEte \'c:/TEMP.PNG\'')
-
-    def saveWaveform(self, file_name):
-        # Save wafeform in csv file
-        self.scope.write('SAVe:WAVEform ALL,\'c:/TEMP.CSV\'')
-        self.scope.query("*OPC?")
-        
-        # Read file data over
-        self.scope.write('FILESYSTEM:READFILE \'c:/TEMP_ALL.CSV\'') # _ALL will be added automatically
-        try:
-            data = self.scope.read_raw()
-        except visa.VisaIOError as e:
-            print("There was a visa error with the following message: {0} ".format(repr(e)))
-            print("Oscilloscope Error Status Register is: "+str(self.scope.query("*ESR?")))
-            print(self.scope.query("ALLEV?"))
 
-        # Save file to local PC
-        fid = open(file_name + '.csv', 'wb')
-        fid.write(data)
-        fid.close()
-        
-        # delete the temporary waveform file of the Oscilloscope when this is done as well. 
-        self.scope.write('FILESystem:DELEte \'c:/TEMP_ALL.CSV\'')
+        with open(local_file, 'wb') as fid:
+            fid.write(data)
 
     class Channel(Enum):
     # channel definition
@@ -429,7 +1024,7 @@ class Oscilloscope(Instrument):
         """       
         if mode == 'immed':
             self.scope.write("MEASUREMENT:IMMED:TYPE " + type)
-            self.scope.write("MEASUREMENT:IMMED:SOURCE CH" + str(channel))
+            self.scope.write("MEASUREMENT:IMMED:SOURCE CH" + str(channel.value))
             res = self.scope.query("MEASUREMENT:IMMED:VALUE?")
             
         if mode == 'badge':
@@ -446,6 +1041,79 @@ class Oscilloscope(Instrument):
             print("channel " + str(channel.value) + "(" + type + "): " + res) 
         return res
     
+    def curveScale(self, channel: Channel):
+        '''
+        query the scaling factors of the channel curve in one round trip, call ioConfig() first
+        Returns:
+            tuple: (xincr: seconds per sample, ymult: volts per level, yzero: reference voltage, yoff: reference position in level)
+        '''
+        res = self.scope.query('data:source CH%d;:wfmoutpre:xincr?;:wfmoutpre:ymult?;:wfmoutpre:yzero?;:wfmoutpre:yoff?'%channel.value)
+        return tuple(float(r) for r in res.strip().split(';'))
+
+    def curveQuery(self, channel: Channel):
+        '''
+        query the curve of the channel as binary block of unscaled levels, call ioConfig() first
+        '''
+        return self.scope.query_binary_values('data:source CH%d;:curve?'%channel.value, datatype='b', container=np.array)
+
+    def scaledCurve(self, channel: Channel, dtype = np.float64):
+        '''
+        query the scaling factors and the curve of the channel in one compound message and scale the curve on PC,
+        call ioConfig() first
+        Returns:
+            tuple: (scaled wave, xincr: seconds per sample)
+        '''
+        with self.lock:
+            self.scope.write('data:source CH%d;:wfmoutpre:xincr?;:wfmoutpre:ymult?;:wfmoutpre:yzero?;:wfmoutpre:yoff?;:curve?'%channel.value)
+            # the response is 'xincr;ymult;yzero;yoff;' followed by the binary block of the curve
+            block = bytearray(self.scope.read_raw())
+            begin = block.find(b'#')
+            offset, length = visa.util.parse_ieee_block_header(block, begin)
+            # read_raw stops at a termination character inside the block
+            missing = offset + length + len(self.scope.read_termination or '') - len(block)
+            if missing > 0:
+                block.extend(self.scope.read_bytes(missing))
+        xincr, ymult, yzero, yoff = (float(r) for r in block[:begin].decode('ascii').strip(';').split(';'))
+        levels = np.frombuffer(bytes(block[offset:offset + length]), dtype=np.int8).astype(dtype)
+        return waveform.scale(levels, ymult, yzero, yoff), xincr
+
+    def snapshotMeasurement(self, freeze:bool = True, log:bool = True, keys:list = None) -> Dict[tuple, float]:
+        """
+        read every badge registered in self.measure with a single compound query
+        Args:
+            freeze (bool): if true, stop the acquisition and wait for the badges to update in the same message
+            log (bool): if true, print the result
+            keys (list): only read the badges of these (Channel, type), default all
+        Returns:
+            dict: key (Channel, type), value: mean of current acquisition, the oscilloscope zero 9.91E+37 is mapped to 0.0
+        """
+        items = sorted(((key, num) for key, num in self.measure.items() if keys is None or key in keys), key=lambda item: item[1])
+        if len(items) == 0:
+            return {}
+        query = ';:'.join('MEASUrement:MEAS%d:RESUlts:CURRentacq:MEAN?'%num for key, num in items)
+        if freeze:
+            # stop the window and wait for the badge to update before reading
+            res = self.scope.query('ACQUIRE:STATE STOP;*OPC?;:' + query).strip().split(';')[1:]
+        else:
+            res = self.scope.query(query).strip().split(';')
+        snapshot = {}
+        for (key, num), value in zip(items, res):
+            value = float(value)
+            if value == 9.91E+37: # the oscilloscope zero used this value
+                value = 0.0
+            snapshot[key] = value
+            if log:
+                print("channel " + str(key[0].value) + "(" + key[1] + "): " + str(value))
+        return snapshot
+
+    def snapshotValue(self, snapshot:Dict[tuple, float], type = "MEAN", channel:Channel = Channel.vcc):
+        """
+        get the value from snapshotMeasurement(), use immediate measurement if there is no badge of the type
+        """
+        if (channel, type) in snapshot:
+            return snapshot[(channel, type)]
+        return float(self.queryMeasurement(type, channel))
+
     # measureing fan speed in RPM through FG signal frequency
     def acquireMeasure(self):
         result = self.Measure()
@@ -460,25 +1128,73 @@ class Oscilloscope(Instrument):
         result.min_current_on_steady = float(self.queryMeasurement("PK2Pk", self.Channel.current))
         return result
 
-    def load_report(self, new_file_name):
-        """
-        open the current editing report, if not created yet, open the template as blank report, and create specified directory"
-        """
-        if os.path.exists(new_file_name):
-            return openpyxl.load_workbook(new_file_name)
-        else:
-            #  Create the directory with error handling
-            try:
-                dir = os.path.dirname(new_file_name)
-                os.makedirs(dir)
-                print(f"Directory '{dir}' created successfully")
-            except FileExistsError:
-                print(f"Directory '{dir}' already exists")
-            except Exception as e:
-                print(f"An error occurred: {e}")
-            
-            return openpyxl.load_workbook('風扇樣品檢驗報告(for RD).xlsx')
-    
+    def acquireWaveforms(self, channels:tuple = tuple(Channel), single:bool = True):
+        '''
+        pull the curve of every channel from one acquisition and scale them on PC
+        Args:
+            channels (tuple): channels to transfer
+            single (bool): if true, take a single sequence first and restore run/stop mode afterwards,
+                           otherwise the curves are from the current (stopped) acquisition
+        Returns:
+            dict: key Channel, value tuple(scaled wave, seconds per sample)
+        '''
+        self.ioConfig()
+        if single:
+            self.acqConfig()
+        waves = {}
+        for channel in channels:
+            waves[channel] = self.scaledCurve(channel)
+        if single:
+            # acqConfig() left the scope stopped after the sequence, run again as before
+            self.runContinuous()
+        return waves
+
+    def previewWaveforms(self, channels:tuple = (Channel.FG, Channel.current), points:int = 100000):
+        '''
+        curves of the current acquisition for display, a long record is only transferred in a window of points samples
+        starting a little before the trigger, so the transfer does not grow with the horizontal scale
+        Args:
+            channels (tuple): channels to transfer
+            points (int): most samples transferred of each channel
+        Returns:
+            dict: key Channel, value tuple(scaled wave, seconds per sample), as acquireWaveforms()
+        '''
+        self.ioConfig()
+        length = self.record
+        if length > points:
+            trigger = int(length * float(self.scope.query('HORIZONTAL:POSITION?')) / 100)
+            start = min(max(trigger - points // 5, 0), length - points)
+            self.scope.write('data:start %d;:data:stop %d'%(start + 1, start + points))
+        waves = {}
+        for channel in channels:
+            waves[channel] = self.scaledCurve(channel, np.float32)
+        if length > points:
+            # restore the window of the full record
+            self.scope.write('data:start 1;:data:stop %d'%length)
+        return waves
+
+    def computeMeasure(self, waves:dict):
+        '''
+        compute the measurement of acquireMeasure() from the waveforms of acquireWaveforms() on PC
+        '''
+        result = self.Measure()
+        result.start_up_volt = waveform.measure(*waves[self.Channel.vcc], 'MEAN')
+        result.pwm = waveform.measure(*waves[self.Channel.pwm], 'PDUTY')
+        result.rpm = waveform.measure(*waves[self.Channel.FG], 'FREQUENCY')
+        current = waveform.statistics(waves[self.Channel.current][0])
+        result.max_current_on_steady = current['MAXIMUM']
+        result.avg_op_current = current['MEAN']
+        result.max_start_up_current = current['RMS']
+        result.min_current_on_steady = current['PK2PK']
+        return result
+
+    def acquireMeasureFromWaveform(self):
+        '''
+        same result as acquireMeasure(), but the oscilloscope only ships the curves of one acquisition
+        instead of one query per measurement
+        '''
+        return self.computeMeasure(self.acquireWaveforms())
+
     def metric_prefix(self, num: float, length:int = 5, log:bool = True):
         '''
         formatting long number into numbers of thousands, with fixed total length
@@ -498,10 +1214,11 @@ class Oscilloscope(Instrument):
             print('metric_prefix converting %f to %f'%(num, new_value))
         return new_value * (1000**prefix)
     
-    def measure_RPM_and_Curr(self, duty = 0.0, fg = 3, sample_no = 1, new_file_name = 'output', column_rpm=None, column_curr=None,
+    def measure_RPM_and_Curr(self, duty = 0.0, fg = 3, sample_no = 1, report:ReportSession = None, column_rpm=None, column_curr=None,
                              column_curr_max=None):
         """
         under pwm duty, measure current and corresponding RPM from calculation of FG signal frequency divided by FG quantity 
+        :param report:              opened report session to write the result
         :param column_rpm:          columns to fill in measured rpm value
         :type column_rpm:           List[str] | Tuple[str]
         :param column_curr:         columns to fill in measured current value
@@ -512,78 +1229,71 @@ class Oscilloscope(Instrument):
         curr = 'N/A'
         rpm = 'N/A'
         curr_max = 'N/A'
-        wb = self.load_report(new_file_name)
-        sheet = wb.active
         row = str(sample_no + 10)
         warn_msg = 'Please specify columns in a list, the result will not be saved'
+        # read all badges in one round trip
+        snapshot = self.snapshotMeasurement()
         # measure rpm
         if column_rpm is not None:
             if type(column_rpm) not in (list, Tuple):
                 warnings.warn(warn_msg)
             else: 
-                rpm = self.metric_prefix(float(self.queryMeasurement("FREQUENCY", self.Channel.FG, 'badge'))) / fg * 60.0
+                rpm = self.metric_prefix(self.snapshotValue(snapshot, "FREQUENCY", self.Channel.FG)) / fg * 60.0
                 # incase the cell has already written on previous step before resuming from pause
                 for col in column_rpm:
-                    if (sheet[col + row].value == None):
-                        sheet[col + row] = rpm
+                    report.write(col + row, rpm)
                 
         # measure current
         if column_curr is not None:
             if type(column_curr) not in (list, Tuple):
                 warnings.warn(warn_msg)
             else:
-                curr = float(self.queryMeasurement(channel=self.Channel.current, mode='badge'))
+                curr = self.snapshotValue(snapshot, "MEAN", self.Channel.current)
                 for col in column_curr:
-                    if (sheet[col + row].value == None):
-                        sheet[col + row] = curr        
+                    report.write(col + row, curr)
         
         # measure max current
         if column_curr_max is not None:
             if type(column_curr_max) not in (list, Tuple):
                 warnings.warn(warn_msg)
             else:
-                curr_max = float(self.queryMeasurement("MAXIMUM", self.Channel.current, 'badge'))
+                curr_max = self.snapshotValue(snapshot, "MAXIMUM", self.Channel.current)
                 for col in column_curr_max:
-                    if (sheet[col + row].value == None):
-                        sheet[col + row] = curr_max
+                    report.write(col + row, curr_max)
             
-        wb.save(new_file_name)
-        wb.close()
+        report.flush()
 
-    def check_PWM_and_FG(self, sample_no = 1, new_file_name = 'output', column_pwm = None, column_fg = None):
+    def check_PWM_and_FG(self, sample_no = 1, report:ReportSession = None, column_pwm = None, column_fg = None):
         """
         check measured value > 0 and put 'V' at specified columns
         """
         pwm = 'N/A'
         fg = 'N/A'
-        wb = self.load_report(new_file_name)
-        sheet = wb.active
         row = str(sample_no + 10)
         warn_msg = 'Please specify columns in a list, the result will not be saved'
+        # read all badges in one round trip
+        snapshot = self.snapshotMeasurement()
         
         # measure pwm
         if column_pwm is not None:
             if type(column_pwm) not in (list, Tuple):
                 warnings.warn(warn_msg)
             else:
-                pwm = float(self.queryMeasurement("PDUTY", self.Channel.pwm))
+                pwm = self.snapshotValue(snapshot, "PDUTY", self.Channel.pwm)
                 # incase the cell has already written on previous step before resuming from pause
                 for col in column_pwm:
-                    if (sheet[col + row].value == None):
-                        sheet[col + row] = 'V' if pwm > 0 else 'FAIL'
+                    report.write(col + row, 'V' if pwm > 0 else 'FAIL')
         # measure fg
         if column_fg is not None:
             if type(column_fg) not in (list, Tuple):
                 warnings.warn(warn_msg)
             else:
-                fg = float(self.queryMeasurement("FREQUENCY", self.Channel.FG))
+                fg = self.snapshotValue(snapshot, "FREQUENCY", self.Channel.FG)
                 # incase the cell has already written on previous step before resuming from pause
                 for col in column_fg:
-                    if (sheet[col + row].value == None):
-                        sheet[col + row] = 'V' if fg > 0 else 'FAIL'
+                    report.write(col + row, 'V' if fg > 0 else 'FAIL')
             
-        wb.save(new_file_name)
-        wb.close()
+        report.flush()
 
     def setScale(self, type: Literal['H','V'] = 'V', channel: Channel = Channel.current, scale = 0.2):
         """
@@ -591,9 +1301,9 @@ class Oscilloscope(Instrument):
                      'V' set vertical scale for numbers of voltage or ampere per division
         """
         if type == 'H':
-            self.scope.write('HORizontal:SCAle ' + str(scale))
+            self.setting('horizontal_scale', scale, 'HORizontal:SCAle ' + str(scale))
         elif type == 'V':
-            self.scope.write('DISplay:WAVEView1:CH%d:VERTical:SCAle %s'%(channel.value, str(scale)))
+            self.setting(('scale', channel), scale, 'DISplay:WAVEView1:CH%d:VERTical:SCAle %s'%(channel.value, str(scale)))
         else:
             warnings.warn('setScale: wrong type: %s'%type)
     
@@ -607,9 +1317,9 @@ class Oscilloscope(Instrument):
                          (0 = left edge, 100 = right edge)
         """
         if type == 'V':
-            self.scope.write('DISplay:WAVEView1:CH%d:VERTical:POSition %f'%(channel.value, position))
+            self.setting(('position', channel), position, 'DISplay:WAVEView1:CH%d:VERTical:POSition %f'%(channel.value, position))
         elif type == 'H':
-            self.scope.write('HORIZONTAL:POSITION %f'%position)
+            self.setting('horizontal_position', position, 'HORIZONTAL:POSITION %f'%position)
         else:
             warnings.warn('setPosition: wrong type: %s'%type)
 
@@ -631,11 +1341,21 @@ class Oscilloscope(Instrument):
         if reset:
             self.scope.write('MEASUrement:MEAS%d:TYPe %s'%(num, type))
             self.scope.write('MEASUrement:MEAS%d:SOUrce CH%d'%(num, channel.value))
-            self.scope.query("*OPC?")
+            if not self.batching():
+                # a batch syncs once at the end
+                self.scope.query("*OPC?")
         self.measure[(channel, type)] = num
+
+    def deleteMeasurement(self, num:int):
+        '''
+        Delete the oscilloscope badge and remove it from the measurement dictionary
+        '''
+        self.scope.write('MEASUREMENT:DELETE "MEAS%d"'%num)
+        for key in [key for key, value in self.measure.items() if value == num]:
+            self.measure.pop(key)
     
     def turnOn(self, channel: Channel):
-        self.scope.write(':DISPLAY:WAVEVIEW1:CH%d:STATE 1'%channel.value)
+        self.setting(('display', channel), 1, ':DISPLAY:WAVEVIEW1:CH%d:STATE 1'%channel.value)
 
     def setMeasurement(self, res:bool = False):
         '''
@@ -643,13 +1363,17 @@ class Oscilloscope(Instrument):
         Args:
             res (bool): if true, reset the oscilloscope before setting up
         '''
+        with self.batch(sync=res):
+            self._setMeasurement(res)
+
+    def _setMeasurement(self, res:bool):
         self.turnOn(self.Channel.vcc)
         self.turnOn(self.Channel.pwm)
         self.turnOn(self.Channel.FG)
         self.turnOn(self.Channel.current)
-        self.scope.write('DISplay:WAVEView1:VIEWStyle OVERLAY')
-        self.scope.write('HORIZONTAL:MODE MANUAL')
-        self.scope.write('HORIZONTAL:MODE:SAMPLERATE 1e6')
+        self.setting('view_style', 'OVERLAY', 'DISplay:WAVEView1:VIEWStyle OVERLAY')
+        self.setting('horizontal_mode', 'MANUAL', 'HORIZONTAL:MODE MANUAL')
+        self.setting('sample_rate', 1e6, 'HORIZONTAL:MODE:SAMPLERATE 1e6')
         self.setScale('H', scale=1e-3)
         self.setScale('V', self.Channel.vcc, 5)
         self.setScale('V', self.Channel.pwm, 2)
@@ -660,26 +1384,73 @@ class Oscilloscope(Instrument):
         self.setPosition('V', self.Channel.FG, -1.5)
         self.setPosition('V', self.Channel.current, -3.7)
         self.setPosition('H', position=20)
-        self.scope.write('TRIGGER:A:MODE AUTO')
+        self.setting('trigger_mode', 'AUTO', 'TRIGGER:A:MODE AUTO')
         if res:
-            # add measurements
             self.scope.write('MEASUrement:DELETEALL')
-            self.addMeasurement(1, self.Channel.vcc, 'TOP', reset = res)
-            self.addMeasurement(2, self.Channel.vcc, 'MEAN', reset = res)
-            self.addMeasurement(3, self.Channel.pwm, 'PDUTY', reset = res)
-            self.addMeasurement(4, self.Channel.FG, 'FREQUENCY', reset = res)
-            self.addMeasurement(5, self.Channel.current, 'MAXIMUM', reset = res)
-            self.addMeasurement(6, self.Channel.current, 'MEAN', reset = res)
-            self.addMeasurement(7, self.Channel.current, 'RMS', reset = res)
-            self.addMeasurement(8, self.Channel.current, 'PK2PK', reset = res)
+        self.measure.clear()
+        # add measurements, register existing badges if not reset
+        self.addMeasurement(1, self.Channel.vcc, 'TOP', reset = res)
+        self.addMeasurement(2, self.Channel.vcc, 'MEAN', reset = res)
+        self.addMeasurement(3, self.Channel.pwm, 'PDUTY', reset = res)
+        self.addMeasurement(4, self.Channel.FG, 'FREQUENCY', reset = res)
+        self.addMeasurement(5, self.Channel.current, 'MAXIMUM', reset = res)
+        self.addMeasurement(6, self.Channel.current, 'MEAN', reset = res)
+        self.addMeasurement(7, self.Channel.current, 'RMS', reset = res)
+        self.addMeasurement(8, self.Channel.current, 'PK2PK', reset = res)
 
     def setTrigger(self, channel: Channel = Channel.current, level:float = 2.0):
-        self.scope.write('TRIGGER:A:MODE NORMAL')
-        self.scope.write('TRIGGER:A:TYPe EDGE')
-        self.scope.write('TRIGger:A:EDGE:SOUrce CH%d'%channel.value)
-        self.scope.write('TRIGGER:A:LEVEL:CH%d '%channel.value + str(level))
-        self.scope.write('TRIGGER:A:EDGE:SLOpe RISe')
-        self.scope.query("*OPC?")
+        with self.batch(sync=True):
+            self.setting('trigger_mode', 'NORMAL', 'TRIGGER:A:MODE NORMAL')
+            self.setting('trigger_type', 'EDGE', 'TRIGGER:A:TYPe EDGE')
+            self.setting('trigger_source', channel, 'TRIGger:A:EDGE:SOUrce CH%d'%channel.value)
+            self.setting(('trigger_level', channel), level, 'TRIGGER:A:LEVEL:CH%d '%channel.value + str(level))
+            self.setting('trigger_slope', 'RISE', 'TRIGGER:A:EDGE:SLOpe RISe')
+
+    def triggerReady(self):
+        '''
+        True if the trigger system is armed and waiting for the trigger event
+        '''
+        return self.scope.query('TRIGger:STATE?').strip() == 'READY'
+
+    def armSequenceNotice(self):
+        '''
+        ask for a service request when the started single sequence is captured, call after 'acquire:state 1'.
+        The request sets self.sequence_complete from the VISA event thread.
+        :return: False if the VISA backend does not support service request, sequenceDone() asks the acquisition state instead
+        '''
+        self.sequence_complete.clear()
+        if not self.srq_available:
+            return False
+        try:
+            if self.srq_handler is None:
+                handler = self.scope.wrap_handler(self.onServiceRequest)
+                self.scope.install_handler(visa.constants.EventType.service_request, handler)
+                self.scope.enable_event(visa.constants.EventType.service_request, visa.constants.EventMechanism.handler)
+                self.srq_handler = handler
+            # operation complete bit -> event status bit of the status byte -> service request
+            self.scope.write('*ESE 1;*SRE 32;*OPC')
+            return True
+        except (AttributeError, NotImplementedError, visa.VisaIOError) as e:
+            print('service request is not available, polling the acquisition state: %r'%e)
+            self.srq_handler = None
+            self.srq_available = False
+            return False
+
+    def onServiceRequest(self, resource, event, user_handle):
+        self.sequence_complete.set()
+
+    def sequenceDone(self):
+        '''
+        True if the single sequence is captured, from the service request if armed, otherwise asking the acquisition state
+        '''
+        if self.srq_handler is None:
+            return self.scope.query('ACQuire:STATE?').strip() == '0'
+        if not self.sequence_complete.is_set():
+            return False
+        # disable the request and clear the event status register
+        self.scope.write('*SRE 0')
+        self.scope.query('*ESR?')
+        return True
 
     def readImage(self, file_name:str = 'max_current'):
         #self.scope.query("*OPC?")  #Make sure the image has been saved before trying to read the file
@@ -714,16 +1485,18 @@ class PowerSupply(Instrument):
         """)
 
     def setVoltage(self, volt):
-        self.scope.write("SOUR:VOLT " + str(volt))
+        self.setting('voltage', volt, "SOUR:VOLT " + str(volt))
 
     def setCurrent(self, cur):
-        self.scope.write("SOUR:CURR " + str(cur))
+        self.setting('current', cur, "SOUR:CURR " + str(cur))
 
     def setOutputOn(self):
-        self.scope.write("CONFIgure:OUTPut ON")
+        # a protection trip or the front panel may have turned the output off
+        self.setting('output', True, "CONFIgure:OUTPut ON", force=True)
     
     def setOutputOff(self):
-        self.scope.write("CONFIgure:OUTPut OFF")
+        # always sent, turning off the power is the safe state when pausing or stopping
+        self.setting('output', False, "CONFIgure:OUTPut OFF", force=True)
 
 class SignalGenerator(Instrument):
     def __init__(self):
@@ -738,23 +1511,97 @@ class SignalGenerator(Instrument):
         """)
 
     def setPWMOutput(self):
-        self.scope.write('SOURCE1:FUNCTION:SHAPE PULS')
-        #self.scope.write('SOURce1:PWM:STATe ON')
-        self.scope.write('SOURce1:PWM:SOURce INTernal')
-        self.scope.write('FREQuency 25E3')
-        self.scope.write('OUTPut1:IMPedance INFinity')
-        self.scope.write('SOURce1:PWM:INTernal:FUNCtion SQUare')
-        self.scope.write('SOURce1:VOLTage:LEVel:IMMediate:AMPLitude 5VPP')
-        self.scope.write('SOURce1:VOLTage:LEVel:IMMediate:OFFSet 2.5V')
+        with self.batch():
+            # the pulse shape stands for the whole PWM setup
+            if not self.setting('pwm_output', True, 'SOURCE1:FUNCTION:SHAPE PULS'):
+                return
+            #self.scope.write('SOURce1:PWM:STATe ON')
+            self.scope.write('SOURce1:PWM:SOURce INTernal')
+            self.scope.write('FREQuency 25E3')
+            self.scope.write('OUTPut1:IMPedance INFinity')
+            self.scope.write('SOURce1:PWM:INTernal:FUNCtion SQUare')
+            self.scope.write('SOURce1:VOLTage:LEVel:IMMediate:AMPLitude 5VPP')
+            self.scope.write('SOURce1:VOLTage:LEVel:IMMediate:OFFSet 2.5V')
     
     def setPWMDuty(self, duty = 5.0):
         if (duty > 99.25):
             duty = 99.981
         if (duty < 1.0):
             duty = 0.025
-        self.scope.write("SOURce1:PULSe:DCYCle " + str(duty))
-        # offset 2.5V
-        r = self.scope.query('*opc?') # sync
+        if self.setting('duty', duty, "SOURce1:PULSe:DCYCle " + str(duty)):
+            # offset 2.5V
+            r = self.scope.query('*opc?') # sync
 
     def setOutputOn(self):
-        self.scope.write("OUTPut1:STATe ON")
\ No newline at end of file
+        self.setting('output', True, "OUTPut1:STATe ON")
+
+class SettleDetector:
+    """
+    Decide a test step is settled from the FG frequency and the mean current sampled while the acquisition runs.
+    The step is settled when the last `window` samples of both values spread within `tolerance` of their mean
+    (or within the absolute tolerance near zero) and their mean moved less than `drift` from the mean of the window before,
+    not earlier than min_time and at most max_time after the start.
+    A sample equal to the one before is from the same acquisition and is not counted.
+    """
+    def __init__(self, osc:Oscilloscope, window:int = 5, tolerance:float = 0.02, min_time:float = 1.0, max_time:float = 15.0,
+                 abs_tolerance:tuple = (0.5, 0.005), drift:float = 0.005, callback = None):
+        '''
+        Parameters
+        ----------
+        window : number of samples that should agree
+        tolerance : allowed spread (max - min) relative to the mean
+        min_time, max_time : seconds after the detector is created
+        abs_tolerance : allowed spread of (frequency in Hz, current in A), for values near zero
+        drift : allowed change of the mean between two consecutive windows relative to the mean,
+                a slow approach to the final value has a small spread in one window but keeps drifting
+        callback : called with (frequency, current) of every sample, ex: to plot the trend
+        '''
+        self.osc = osc
+        self.window = window
+        self.tolerance = tolerance
+        self.min_time = min_time
+        self.max_time = max_time
+        self.abs_tolerance = abs_tolerance
+        self.drift = drift
+        self.callback = callback
+        self.samples = collections.deque(maxlen=2 * window) # tuple(frequency, current), the last two windows
+        self.start = time.monotonic()
+        self.timed_out = False
+
+    def sample(self):
+        snapshot = self.osc.snapshotMeasurement(freeze=False, log=False)
+        frequency = self.osc.snapshotValue(snapshot, 'FREQUENCY', Oscilloscope.Channel.FG)
+        current = self.osc.snapshotValue(snapshot, 'MEAN', Oscilloscope.Channel.current)
+        if self.samples and self.samples[-1] == (frequency, current):
+            # no new acquisition since the last sample, ex: the acquisition is stopped
+            return
+        self.samples.append((frequency, current))
+        if self.callback is not None:
+            self.callback(frequency, current)
+
+    def stable(self):
+        if len(self.samples) < 2 * self.window:
+            return False
+        samples = list(self.samples)
+        for before, values, abs_tolerance in zip(zip(*samples[:self.window]), zip(*samples[self.window:]), self.abs_tolerance):
+            mean = sum(values) / len(values)
+            if max(values) - min(values) > max(self.tolerance * abs(mean), abs_tolerance):
+                return False
+            if abs(mean - sum(before) / len(before)) > max(self.drift * abs(mean), abs_tolerance * self.drift / self.tolerance):
+                return False
+        return True
+
+    def settled(self):
+        """
+        take a sample and return True if the step is settled or max_time has passed
+        """
+        self.sample()
+        elapsed = time.monotonic() - self.start
+        if elapsed >= self.max_time:
+            self.timed_out = True
+            print('not settled in %.1f s, last samples (Hz, A): %s'%(elapsed, list(self.samples)))
+            return True
+        if elapsed < self.min_time or not self.stable():
+            return False
+        print('settled in %.2f s'%elapsed)
+        return True
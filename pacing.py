@@ -0,0 +1,53 @@
+'''
+Drift-free fixed rate schedule for the logging loops.
+
+The deadlines are start + n * period on time.monotonic(), so the time spent reading does not add up
+like sleeping a fixed time after each reading. A deadline already passed is counted as missed and skipped.
+
+Typical usage:
+    schedule = FixedRateSchedule(0.1)
+    while schedule.wait():
+        read()
+    print(schedule.rate(), schedule.missed)
+'''
+import threading
+import time
+
+class FixedRateSchedule:
+    def __init__(self, period: float, stop: threading.Event = None):
+        '''
+        Args:
+            period (float): seconds between deadlines
+            stop (threading.Event): wait() returns False once it is set
+        '''
+        self.period = period
+        self.stop = stop if stop is not None else threading.Event()
+        self.start = time.monotonic()
+        self.next = self.start # the first wait() returns at once
+        self.ticks = 0 # number of deadlines served
+        self.missed = 0 # number of deadlines skipped because the loop was late
+
+    def wait(self):
+        '''
+        block until the next deadline, skip the deadlines already passed
+        :return: False if stopped
+        '''
+        now = time.monotonic()
+        if now > self.next + self.period:
+            late = int((now - self.next) / self.period)
+            self.missed += late
+            self.next += late * self.period
+        if self.stop.wait(max(0.0, self.next - now)):
+            return False
+        self.next += self.period
+        self.ticks += 1
+        return True
+
+    def lateness(self):
+        ''' seconds between the last deadline and now '''
+        return time.monotonic() - (self.next - self.period)
+
+    def rate(self):
+        ''' achieved deadlines per second since start '''
+        elapsed = time.monotonic() - self.start
+        return self.ticks / elapsed if elapsed > 0 else 0.0
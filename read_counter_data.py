@@ -1,33 +1,270 @@
 from pymodbus import FramerType
 from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusIOException
+from pymodbus.exceptions import ModbusException
+from pacing import FixedRateSchedule
+from log_writer import LogWriter
 import time
 import csv
 import argparse
+import threading
+import numpy as np # http://www.numpy.org/
+
+MAX_REGISTERS = 125 # registers of one read holding registers request
+
+def decode_registers(registers, dtype: str = 'u4', word_order: str = 'big'):
+    ''' Decode a block of 16 bit registers to 32/64 bit integers
+    Args:
+        registers (list): register values, length is a multiple of the words of dtype
+        dtype (str): 'u4', 'i4', 'u8' or 'i8', unsigned or signed 32/64 bit
+        word_order (str): 'big' if the first register is the most significant word, or 'little'
+    Returns:
+        numpy.ndarray: decoded values
+    '''
+    dtype = np.dtype(dtype)
+    words = dtype.itemsize // 2
+    block = np.asarray(registers, dtype=np.uint16).reshape(-1, words)
+    if word_order == 'little':
+        block = block[:, ::-1]
+    return np.frombuffer(block.astype('>u2').tobytes(), dtype=dtype.newbyteorder('>')).astype(dtype)
+
+class CounterRate:
+    '''
+    Counts per second of counters from consecutive reads, the difference wraps around at the width of the counter.
+    '''
+    def __init__(self, dtype: str = 'u4'):
+        self.unsigned = np.dtype(dtype.replace('i', 'u'))
+        self.half = 1 << (self.unsigned.itemsize * 8 - 1)
+        self.values = None # last read counters
+        self.time = None # monotonic time of the last read
+        self.rates = None
+
+    def update(self, values: np.ndarray, now: float = None):
+        '''
+        :return: counts per second of each counter since the last read, nan for the first read or a counter reset
+        '''
+        now = time.monotonic() if now is None else now
+        values = np.asarray(values).view(self.unsigned)
+        if self.values is None or len(self.values) != len(values) or now <= self.time:
+            self.rates = np.full(len(values), np.nan)
+        else:
+            diff = values - self.values # unsigned subtraction wraps around
+            self.rates = np.where(diff < self.half, diff, np.nan) / (now - self.time)
+        self.values = values.copy()
+        self.time = now
+        return self.rates
+
+def log_columns(quantity: int = 2, dtype: str = 'u4', rate: bool = False):
+    ''' header and binary dtypes of the log of a slave, the original header if it is one counter without rate '''
+    count = quantity // (np.dtype(dtype).itemsize // 2)
+    names = ['Data'] if count == 1 else ['Data%d'%i for i in range(count)]
+    header = ['Timestamp'] + names
+    dtypes = [dtype] * count
+    if rate:
+        header += ['Rate'] if count == 1 else ['Rate%d'%i for i in range(count)]
+        dtypes += ['f8'] * count
+    return header, dtypes
+
+def read_registers(client: ModbusSerialClient, starting_address: int, quantity: int, slave_address: int, words: int = 2):
+    ''' Read a contiguous register block, split into requests of at most MAX_REGISTERS aligned to words
+    Returns:
+        list: registers, or the error response
+    '''
+    step = MAX_REGISTERS // words * words
+    registers = []
+    for address in range(starting_address, starting_address + quantity, step):
+        count = min(step, starting_address + quantity - address)
+        result = client.read_holding_registers(address=address, count=count, slave=slave_address)
+        if result.isError():
+            return result
+        registers += result.registers
+    return registers
 
 def read_and_store(client: ModbusSerialClient, 
                   starting_address: int = 0x0040, 
                   quantity: int = 2, 
                   slave_address: int = 0,
-                  filename: str = 'counter_data.csv'):
+                  filename: str = 'counter_data.csv',
+                  writer: LogWriter = None,
+                  dtype: str = 'u4',
+                  word_order: str = 'big',
+                  counter_rate: CounterRate = None):
     ''' Read and store data from Modbus device
     Args:
         client (ModbusSerialClient): Modbus client object
         starting_address (int): Starting address to read from
-        quantity (int): Number of registers to read
+        quantity (int): Number of registers to read, the counters are read in one request
         slave_address (int): Slave address(integer) of the Modbus device
         filename (str): Name of the file to save data
+        writer (LogWriter): Log of the slave kept open between reads, filename is not used if given
+        dtype (str): type of the counters, 'u4', 'i4', 'u8' or 'i8'
+        word_order (str): 'big' if the first register is the most significant word, or 'little'
+        counter_rate (CounterRate): saves the counts per second after the counters if given
+    Returns:
+        bool: True if the data is read
     '''
     # Read holding registers
-    result = client.read_holding_registers(address=starting_address, count=quantity, slave=slave_address)
-    if not result.isError():
-        print(f"Slave id {slave_address} Received: {result.registers}")
+    registers = read_registers(client, starting_address, quantity, slave_address, np.dtype(dtype).itemsize // 2)
+    if isinstance(registers, list):
+        values = decode_registers(registers, dtype, word_order)
+        data = values.tolist()
+        if counter_rate is not None:
+            data += counter_rate.update(values).tolist()
+            print(f"Slave id {slave_address} Received: {values.tolist()} rate: {np.round(counter_rate.rates, 3).tolist()}/s")
+        else:
+            print(f"Slave id {slave_address} Received: {values.tolist()}")
         # Save data to file
+        if writer is not None:
+            writer.write(data)
+            return True
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        data = [timestamp, merge_registers_to_int(result.registers)]
-        save_data_to_file(data, filename=filename)        
+        save_data_to_file([timestamp] + data, filename=filename, header=log_columns(quantity, dtype, counter_rate is not None)[0])
+        return True
     else:
-        print(f"Slave id {slave_address}: Error reading data: {result}")
+        print(f"Slave id {slave_address}: Error reading data: {registers}")
+        return False
+
+def connect_client(name: str = 'COM4', timeout: float = 1, retries: int = 0):
+    ''' Open the Modbus RTU client of a serial port
+    Args:
+        name (str): Serial port name (example: COM4 or /dev/ttyUSB0)
+        timeout (float): Default seconds to wait for a response
+        retries (int): Retries of a request without response, the poller backs off a dead slave instead
+    Returns:
+        ModbusSerialClient: connected client, or None if the port can not be opened
+    '''
+    client = ModbusSerialClient(
+        framer=FramerType.RTU,
+        port=name,  # Replace with your COM port
+        baudrate=19200,  # Adjust baudrate as per your device
+        timeout=timeout,
+        retries=retries,
+        stopbits=2,
+        bytesize=8,
+        parity='N'
+    )
+    if not client.connect():
+        print("Cannot open %s."%name)
+        return None
+    print("Connected to Modbus device on %s."%name)
+    return client
+
+def set_timeout(client: ModbusSerialClient, timeout: float):
+    ''' Change the response timeout of the client before a request '''
+    client.comm_params.timeout_connect = timeout
+    if client.socket is not None:
+        client.socket.timeout = timeout
+
+class Slave:
+    '''
+    Polling state of one counter: its own response timeout, and exponential backoff after failures
+    so a dead slave does not take the bus time of the others.
+    '''
+    def __init__(self, address: int, filename: str, timeout: float = 1, max_backoff: float = 60.0):
+        '''
+        Args:
+            address (int): Slave address of the Modbus device
+            filename (str): Name of the file to save data
+            timeout (float): Seconds to wait for the response of this slave
+            max_backoff (float): Longest seconds between retries of a failing slave
+        '''
+        self.address = address
+        self.filename = filename
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.writer = None # LogWriter opened by the poller
+        self.counter_rate = None # CounterRate if the rate is saved
+        self.polls = 0 # successful reads
+        self.errors = 0 # failed reads
+        self.failures = 0 # consecutive failed reads
+        self.retry_time = 0.0 # monotonic time the slave is polled again after failures
+
+    def due(self, now: float):
+        return now >= self.retry_time
+
+    def succeeded(self):
+        self.polls += 1
+        self.failures = 0
+        self.retry_time = 0.0
+
+    def failed(self, now: float, period: float):
+        self.errors += 1
+        self.failures += 1
+        backoff = min(period * 2 ** (self.failures - 1), self.max_backoff)
+        self.retry_time = now + backoff
+        print(f"Slave id {self.address}: {self.failures} failures, retry in {backoff:g} s")
+
+class PortPoller(threading.Thread):
+    '''
+    Poll the slaves of one serial port on a fixed rate schedule, one thread per port so the ports run at the same time.
+    '''
+    def __init__(self, name: str, slaves: list, sleep_time: float = 5, stop: threading.Event = None,
+                 client_kwargs: dict = None, log_kwargs: dict = None, rate: bool = False, **kwargs):
+        '''
+        Args:
+            name (str): Serial port name (example: COM4 or /dev/ttyUSB0)
+            slaves (list): list of Slave
+            sleep_time (float): Period of polling all slaves in seconds
+            stop (threading.Event): set to stop polling
+            client_kwargs (dict): keyword arguments of connect_client()
+            log_kwargs (dict): keyword arguments of LogWriter, ex: {'rotate': 'day', 'format': 'bin'}
+            rate (bool): also save the counts per second of the counters
+            **kwargs: Additional arguments of read_and_store()
+        '''
+        super().__init__(name=name, daemon=True)
+        self.port = name
+        self.slaves = slaves
+        self.sleep_time = sleep_time
+        self.stop = stop if stop is not None else threading.Event()
+        self.client_kwargs = client_kwargs or {}
+        self.log_kwargs = log_kwargs or {}
+        self.rate = rate
+        self.kwargs = kwargs
+        self.schedule = None
+
+    def run(self):
+        client = connect_client(self.port, **self.client_kwargs)
+        if client is None:
+            return
+        dtype = self.kwargs.get('dtype', 'u4')
+        header, dtypes = log_columns(self.kwargs.get('quantity', 2), dtype, self.rate)
+        for slave in self.slaves:
+            slave.writer = LogWriter(slave.filename, header, dtypes=dtypes, **self.log_kwargs)
+            slave.counter_rate = CounterRate(dtype) if self.rate else None
+        try:
+            self.schedule = FixedRateSchedule(self.sleep_time, self.stop)
+            while self.schedule.wait():
+                for slave in self.slaves:
+                    if self.stop.is_set():
+                        break
+                    if slave.due(time.monotonic()):
+                        self.poll(client, slave)
+        finally:
+            for slave in self.slaves:
+                slave.writer.close()
+            client.close()
+            print("Connection %s closed."%self.port)
+
+    def poll(self, client: ModbusSerialClient, slave: Slave):
+        set_timeout(client, slave.timeout)
+        try:
+            ok = read_and_store(client, slave_address=slave.address, filename=slave.filename, writer=slave.writer,
+                                counter_rate=slave.counter_rate, **self.kwargs)
+        except ModbusException as e:
+            print(f"Slave id {slave.address}: Modbus error: {e}")
+            ok = False
+        if ok:
+            slave.succeeded()
+        else:
+            slave.failed(time.monotonic(), self.sleep_time)
+
+    def status(self):
+        ''' achieved poll rate of the port and each slave '''
+        if self.schedule is None:
+            return {'port': self.port, 'rate': 0.0, 'missed': 0, 'slaves': []}
+        elapsed = time.monotonic() - self.schedule.start
+        return {'port': self.port, 'rate': self.schedule.rate(), 'missed': self.schedule.missed,
+                'slaves': [{'address': s.address, 'rate': s.polls / elapsed if elapsed > 0 else 0.0,
+                            'errors': s.errors, 'failures': s.failures} for s in self.slaves]}
 
 def read_counter_data(name: str = 'COM4', 
                       slave_addresses: list = [0,1], 
@@ -38,51 +275,62 @@ def read_counter_data(name: str = 'COM4',
     Args:
         name (str): Serial port name (example: COM4 or /dev/ttyUSB0)
         slave_address (list): list of slave address(integer) of the Modbus device
-        sleep_time (int): Time to wait before next read
+        sleep_time (int): Time between the start of two reads
         output_files (list): Output file name to save data
         **kwargs: Additional arguments
     '''
+    read_counters({name: list(zip(slave_addresses, output_files))}, sleep_time=sleep_time, **kwargs)
+
+def read_counters(ports: dict,
+                  sleep_time: float = 5,
+                  timeout: float = 1,
+                  status_time: float = 60,
+                  log_kwargs: dict = None,
+                  rate: bool = False,
+                  **kwargs):
+    ''' Read counter data from several rs485 ports at the same time until Ctrl+C
+    Args:
+        ports (dict): key: serial port name, value: list of tuple(slave address, output file)
+        sleep_time (float): Period of polling the slaves of a port in seconds
+        timeout (float): Seconds to wait for the response of a slave
+        status_time (float): Seconds between printing the achieved poll rate
+        log_kwargs (dict): keyword arguments of LogWriter, ex: {'rotate': 'day', 'format': 'bin'}
+        rate (bool): also save the counts per second of the counters
+        **kwargs: Additional arguments of read_and_store(), ex: starting_address, quantity, dtype, word_order
+    '''
+    stop = threading.Event()
+    pollers = [PortPoller(name, [Slave(address, filename, timeout) for address, filename in slaves], sleep_time, stop,
+                          {'timeout': timeout}, log_kwargs, rate, **kwargs)
+               for name, slaves in ports.items()]
+    for poller in pollers:
+        poller.start()
     try:
-        # Configure the serial connection
-        client = ModbusSerialClient(
-            framer=FramerType.RTU,
-            port=name,  # Replace with your COM port
-            baudrate=19200,  # Adjust baudrate as per your device
-            timeout=1,
-            stopbits=2,
-            bytesize=8,
-            parity='N'
-        )
-        if client.connect():
-            print("Connected to Modbus device on %s."%name)
-        
-            while True:
-                # Read holding registers
-                for slave_address, output_file in zip(slave_addresses, output_files):
-                    # Read and store data
-                    read_and_store(client, slave_address=slave_address, filename=output_file, **kwargs)
-                # Wait for sleep_time in seconds
-                time.sleep(sleep_time)
-
-    except ModbusIOException as e:
-        print(f"Modbus error: {e}")
+        while any(poller.is_alive() for poller in pollers):
+            if stop.wait(status_time):
+                break
+            for poller in pollers:
+                status = poller.status()
+                print(f"{status['port']}: {status['rate']:.3f} polls/s, missed {status['missed']}, " +
+                      ", ".join(f"slave {s['address']} {s['rate']:.3f}/s errors {s['errors']}" for s in status['slaves']))
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
-        client.close()
-        print("Connection closed.")
+        stop.set()
+        for poller in pollers:
+            poller.join()
 
-def save_data_to_file(data, filename='counter_data.csv'):
+def save_data_to_file(data, filename='counter_data.csv', header=['Timestamp', 'Data']):
     ''' Save data to CSV file
     Args:
         data (list): Data to be saved
         filename (str): Name of the file to save data
+        header (list): Column names written to an empty file
     '''
     with open(filename, 'a', newline='') as csvfile:
         writer = csv.writer(csvfile)
         # Write header if file is empty
         if csvfile.tell() == 0:
-            writer.writerow(['Timestamp', 'Data'])
+            writer.writerow(header)
         writer.writerow(data)
 
 def merge_registers_to_int(register_array):
@@ -93,24 +341,40 @@ def merge_registers_to_int(register_array):
         int: Merged integer value
     '''
     # Convert register array to integer
-    result = 0
-    for register in register_array:
-        result = (result << 16) | register
-    return result
+    return int.from_bytes(np.asarray(register_array, dtype='>u2').tobytes(), 'big')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Read and save counter data from Modbus device through rs485')
     parser.add_argument('serial_port', type=str, default='COM4', help='Serial port name (example: COM4 or /dev/ttyUSB0)')
     parser.add_argument('slave_id', nargs='+', type=int, help='Slave address(integer) of the Modbus device')
+    parser.add_argument('-p', '--port', nargs='+', action='append', default=[], metavar=('PORT', 'SLAVE_ID'),
+                        help='Another serial port and its slave addresses, can be repeated (example: -p COM5 2 3)')
+    parser.add_argument('-t', '--sleep_time', type=float, default=5, help='Period of polling in seconds')
+    parser.add_argument('--timeout', type=float, default=1, help='Seconds to wait for the response of a slave')
+    parser.add_argument('--rotate', choices=['hour', 'day'], default=None, help='Start a new file every hour or day')
+    parser.add_argument('--format', choices=['csv', 'bin'], default='csv', help='bin: int64 timestamp and counter value records for numpy memmap')
+    parser.add_argument('-a', '--address', type=lambda x: int(x, 0), default=0x0040, help='Starting register address (example: 0x40)')
+    parser.add_argument('-c', '--counters', type=int, default=1, help='Number of contiguous counters read in one request')
+    parser.add_argument('--dtype', choices=['u4', 'i4', 'u8', 'i8'], default='u4', help='Unsigned or signed 32/64 bit counter')
+    parser.add_argument('--word_order', choices=['big', 'little'], default='big', help='big: the first register is the most significant word')
+    parser.add_argument('--rate', action='store_true', help='Also save the counts per second')
     args = parser.parse_args()
     
-    args.file_name = [f'counter_data_{slave_id}.csv' for slave_id in args.slave_id]
+    ports = {args.serial_port: args.slave_id}
+    for port in args.port:
+        ports[port[0]] = [int(slave_id) for slave_id in port[1:]]
+    # file name per port and slave, the first port keeps the original names
+    files = {}
+    for i, (port, slave_ids) in enumerate(ports.items()):
+        prefix = 'counter_data_' if i == 0 else f'counter_data_{port.replace("/", "_")}_'
+        files[port] = [(slave_id, f'{prefix}{slave_id}.csv') for slave_id in slave_ids]
 
-    print(f"Serial port: {args.serial_port}")
-    print(f"Slave addresses: {args.slave_id}")
-    print(f"Output file names: {args.file_name}")
+    for port, slaves in files.items():
+        print(f"Serial port: {port}")
+        print(f"Slave addresses: {[slave_id for slave_id, _ in slaves]}")
+        print(f"Output file names: {[file_name for _, file_name in slaves]}")
     # Call the function with command line arguments
-    read_counter_data(name=args.serial_port,
-                      slave_addresses=args.slave_id,
-                      output_files=args.file_name,
-                      sleep_time=5)
\ No newline at end of file
+    read_counters(files, sleep_time=args.sleep_time, timeout=args.timeout,
+                  log_kwargs={'rotate': args.rotate, 'format': args.format}, rate=args.rate,
+                  starting_address=args.address, quantity=args.counters * int(args.dtype[1]) // 2,
+                  dtype=args.dtype, word_order=args.word_order)
@@ -2,8 +2,10 @@
 This script reads data from an oscilloscope and saves it to a csv file.
 '''
 import model
-import csv
-import datetime
+import waveform
+from log_writer import LogWriter
+from pacing import FixedRateSchedule
+import argparse
 import time
 
 def connect_oscilloscope():
@@ -18,30 +20,54 @@ def connect_oscilloscope():
     
     return model_
 
-def read_oscilloscope_data(filename: str = 'oscilloscope_data.csv', sleep_time:float = 1.0):
+def sample(read, writer: LogWriter, sleep_time: float, status_time: float = 60):
+    ''' Call read() on a fixed rate schedule and write the returned row, print the achieved rate every status_time
+    Args:
+        read (function): returns the columns after the timestamp
+        writer (LogWriter): log of the rows
+        sleep_time (float): Period between readings in seconds
+        status_time (float): Seconds between printing the achieved rate and missed deadlines
+    Returns:
+        FixedRateSchedule: schedule of the sampling, with the achieved rate and missed deadlines
+    '''
+    schedule = FixedRateSchedule(sleep_time)
+    last_status = schedule.start
+    try:
+        while schedule.wait():
+            writer.write(read())
+            if schedule.next - last_status >= status_time:
+                last_status = schedule.next
+                print(f"{schedule.rate():.3f} samples/s (requested {1 / sleep_time:.3f}), missed {schedule.missed}")
+    finally:
+        print(f"{schedule.ticks} samples, {schedule.rate():.3f} samples/s (requested {1 / sleep_time:.3f}), missed {schedule.missed}")
+    return schedule
+
+def read_oscilloscope_data(filename: str = 'oscilloscope_data.csv', sleep_time:float = 1.0, log_kwargs: dict = None):
     ''' Read RPM and current from the oscilloscope and save it to a CSV file.
-    (Because we use string transfer and it is slow, may delay if the sleep_time is less than 0.5sec)
+    The badges are read while the acquisition keeps running, on a fixed rate schedule.
+    (Because we use string transfer and it is slow, may miss deadlines if the sleep_time is less than 0.1sec)
     Args:
         filename (str): Name of the file to save data
-        sleep_time (float): Time to wait between readings in seconds
+        sleep_time (float): Period between readings in seconds
+        log_kwargs (dict): keyword arguments of LogWriter, ex: {'rotate': 'day', 'format': 'bin'}
     '''
     # connect to the oscilloscope
     model = connect_oscilloscope()
-    model.osc.setMeasurement(res=True)
-    model.osc.scope.write('acquire:stopafter RUNSTop')
-    model.osc.scope.write('acquire:state 1') # run
+    osc = model.osc
+    osc.setMeasurement(res=True)
+    osc.scope.write('acquire:stopafter RUNSTop')
+    osc.scope.write('acquire:state 1') # run
     fg = 2 # 2 pulses per revolution
+    keys = [(osc.Channel.FG, 'FREQUENCY'), (osc.Channel.current, 'MEAN')]
+
+    def read():
+        # both badges in one query without stopping the acquisition
+        snapshot = osc.snapshotMeasurement(freeze=False, log=False, keys=keys)
+        return [snapshot[keys[0]] / fg * 60.0, snapshot[keys[1]]]
 
     try:
-    
-        while(True):
-            # Read RPM and current from the oscilloscope
-            rpm = float(model.osc.queryMeasurement("FREQUENCY", model.osc.Channel.FG, 'badge', log=False)) / fg * 60.0
-            curr = float(model.osc.queryMeasurement(channel=model.osc.Channel.current, mode='badge', log=False))
-            
-            model.osc.scope.write('acquire:state 1') # run
-            save_to_csv(rpm, curr, filename=filename)
-            time.sleep(sleep_time)
+        with LogWriter(filename, ['Timestamp', 'RPM', 'Current'], digits=1, **(log_kwargs or {})) as writer:
+            sample(read, writer, sleep_time)
 
     except Exception as e:
         print(f"Error reading data from oscilloscope: {e}")
@@ -50,28 +76,71 @@ def read_oscilloscope_data(filename: str = 'oscilloscope_data.csv', sleep_time:f
         print("exiting...")
     
     finally:
-        model.osc.scope.close()
+        osc.scope.close()
         print("Oscilloscope connection closed.")
     
-def save_to_csv(rpm: float, curr: float, filename: str = 'oscilloscope_data.csv'):
-    ''' Save RPM and current data to a CSV file
+def read_oscilloscope_curve(filename: str = 'oscilloscope_data.csv', sleep_time:float = 0.1, fg:int = 2,
+                            horizontal_scale:float = 0.01, sample_rate:float = 1e5, flush_time:float = 1.0,
+                            log_kwargs: dict = None):
+    ''' Read FG and current channel as binary curve, compute RPM and mean current on PC and append them to a CSV file.
+    (Binary transfer without measurement badges, for logging at 10 Hz or faster)
     Args:
-        rpm (float): RPM value
-        curr (float): Current value
         filename (str): Name of the file to save data
+        sleep_time (float): Period between readings in seconds
+        fg (int): pulses per revolution
+        horizontal_scale (float): seconds per division, the record should contain several FG periods
+        sample_rate (float): samples per second, record length is 10 * horizontal_scale * sample_rate
+        flush_time (float): seconds between writing the buffered rows to disk
+        log_kwargs (dict): keyword arguments of LogWriter, ex: {'rotate': 'day', 'format': 'bin'}
     '''
-    # Save the data to a CSV file
-    with open(filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        # Write header if file is empty
-        if file.tell() == 0:
-            writer.writerow(['Timestamp', 'RPM', 'Current'])
-        now = datetime.datetime.now()
-        # Format timestamp and write data, removing the last 5 digits of microseconds
-        timestamp = now.strftime('%Y-%m-%d %H:%M:%S.%f')
-        writer.writerow([timestamp[:-5], rpm, curr])
+    # connect to the oscilloscope
+    model = connect_oscilloscope()
+    osc = model.osc
+    osc.setMeasurement(res=False)
+    osc.setScale('H', scale=horizontal_scale)
+    osc.setting('sample_rate', sample_rate, 'HORIZONTAL:MODE:SAMPLERATE %g'%sample_rate)
+    osc.scope.write('acquire:stopafter RUNSTop')
+    osc.scope.write('acquire:state 1') # run
+    osc.ioConfig()
+    # the scaling factors do not change while logging
+    fg_dt = osc.curveScale(osc.Channel.FG)[0]
+    curr_scale = osc.curveScale(osc.Channel.current)[1:]
+
+    def read():
+        fg_wave = osc.curveQuery(osc.Channel.FG)
+        curr_wave = osc.curveQuery(osc.Channel.current)
+        rpm = waveform.frequency(fg_wave, fg_dt) / fg * 60.0
+        curr = waveform.scale(curr_wave.mean(), *curr_scale)
+        return [rpm, curr]
+
+    try:
+        with LogWriter(filename, ['Timestamp', 'RPM', 'Current'], digits=3, flush_time=flush_time, **(log_kwargs or {})) as writer:
+            sample(read, writer, sleep_time)
+
+    except Exception as e:
+        print(f"Error reading data from oscilloscope: {e}")
+        
+    except KeyboardInterrupt:
+        print("exiting...")
+    
+    finally:
+        osc.scope.close()
+        print("Oscilloscope connection closed.")
 
 if __name__ == "__main__":
-    read_oscilloscope_data(filename='oscilloscope_data.csv', sleep_time=1.0)
+    parser = argparse.ArgumentParser(description='Read RPM and current from the oscilloscope and save to a CSV file')
+    parser.add_argument('-b', '--binary', action='store_true', help='transfer binary curve and compute on PC, for logging at 10 Hz or faster')
+    parser.add_argument('-t', '--sleep_time', type=float, default=None, help='period of readings in seconds, default 1.0 (0.1 for binary)')
+    parser.add_argument('-f', '--file_name', type=str, default='oscilloscope_data.csv', help='output CSV file')
+    parser.add_argument('--rotate', choices=['hour', 'day'], default=None, help='start a new file every hour or day')
+    parser.add_argument('--format', choices=['csv', 'bin'], default='csv', help='bin: int64 timestamp and float64 records for numpy memmap')
+    args = parser.parse_args()
+    log_kwargs = {'rotate': args.rotate, 'format': args.format}
+    if args.binary:
+        read_oscilloscope_curve(filename=args.file_name, sleep_time=args.sleep_time if args.sleep_time is not None else 0.1,
+                                log_kwargs=log_kwargs)
+    else:
+        read_oscilloscope_data(filename=args.file_name, sleep_time=args.sleep_time if args.sleep_time is not None else 1.0,
+                               log_kwargs=log_kwargs)
     print("Data reading completed.")    
 # This script reads data from an oscilloscope and saves it to a csv file.
\ No newline at end of file
@@ -0,0 +1,772 @@
+'''
+Simulated VISA backend of the test bench, for running and timing the test sequence without instruments.
+
+Simulates the oscilloscope (MSO46), power supply (Chroma 62012P) and signal generator (AFG31052)
+wired to one fan. The instruments keep the settings written by the code and answer queries from a fan
+model, the fan speed and current respond to the PWM duty and the supply voltage. Every command
+sleeps for a configurable latency, so the timing of a sequence is close to the bench.
+
+Typical usage:
+    model_ = model.Model(simulate=True)                     # through the ResourceManager of Model
+    rm = simulator.ResourceManager(latency_scale=0)         # no delay, for quick check
+    rm = simulator.ResourceManager(benches=2)               # 2 sets of instruments for multi-station test
+'''
+import math
+import re
+import threading
+import time
+import numpy as np # http://www.numpy.org/
+import pyvisa as visa # http://github.com/hgrecco/pyvisa
+
+# address of the first bench, the same as the dummy devices of Model
+OSC_ADDRESS = 'USB0::0x0699::0x0527::C033493::INSTR'
+POWER_ADDRESS = 'USB0::0x1698::0x0837::001000005648::INSTR'
+SIGNAL_ADDRESS = 'USB0::0x0699::0x0358::C013019::INSTR'
+
+def header(spec: str):
+    ''' Compile a SCPI header like 'MEASUrement:MEAS#:TYPe' into a regular expression,
+    the lower case part is optional (short form), '#' is a number and trailing digits are optional.
+    The match groups are the numbers, '?' for query and the arguments.
+    '''
+    tokens = []
+    for token in spec.split(':'):
+        if token.startswith('*'):
+            tokens.append(re.escape(token))
+            continue
+        required, optional, suffix = re.match(r'^([A-Z_]+)([a-z_]*)(\d*|#)$', token).groups()
+        regex = required + ('(?:%s)?'%optional.upper() if optional else '')
+        if suffix == '#':
+            regex += r'(\d+)'
+        elif suffix:
+            regex += '(?:%s)?'%suffix
+        tokens.append(regex)
+    return re.compile('^:?' + ':'.join(tokens) + r'(\?)?(?:\s+(.*))?$', re.IGNORECASE)
+
+class FanModel:
+    '''
+    Fan wired to the bench: speed follows the PWM duty and the supply voltage with first order response,
+    current follows the speed, and there is an inrush current when the power output turns on.
+    '''
+    def __init__(self, rated_volt: float = 12.0, max_rpm: float = 6000.0, min_rpm_ratio: float = 0.2,
+                 rated_current: float = 1.0, idle_current: float = 0.05, start_volt: float = 4.0,
+                 tau: float = 1.0, inrush: float = 2.5, fg: int = 2, noise: float = 0.005, seed: int = None):
+        '''
+        Args:
+            rated_volt (float): supply voltage of the rated speed
+            max_rpm (float): speed at 100% duty and rated voltage
+            min_rpm_ratio (float): speed at 0% duty relative to max_rpm
+            rated_current (float): current at max_rpm
+            idle_current (float): current of the driver when the fan stops
+            start_volt (float): the fan does not turn below this voltage
+            tau (float): time constant of the speed response in seconds
+            inrush (float): peak start up current relative to rated_current
+            fg (int): FG pulses per revolution
+            noise (float): relative standard deviation of the measured values
+        '''
+        self.rated_volt = rated_volt
+        self.max_rpm = max_rpm
+        self.min_rpm_ratio = min_rpm_ratio
+        self.rated_current = rated_current
+        self.idle_current = idle_current
+        self.start_volt = start_volt
+        self.tau = tau
+        self.inrush = inrush
+        self.fg = fg
+        self.noise = noise
+        self.random = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        # inputs
+        self.voltage = 0.0
+        self.current_limit = 10.0
+        self.power_on = False
+        self.duty = 0.0
+        self.pwm_on = False
+        self.power_on_time = -math.inf
+        # speed at the last input change
+        self.change_time = time.monotonic()
+        self.change_rpm = 0.0
+
+    def set(self, **inputs):
+        ''' change inputs, ex: set(voltage=12.0, power_on=True) '''
+        with self.lock:
+            now = time.monotonic()
+            self.change_rpm = self._rpm(now)
+            self.change_time = now
+            if inputs.get('power_on') and not self.power_on:
+                self.power_on_time = now
+            for key, value in inputs.items():
+                setattr(self, key, value)
+
+    def volt(self):
+        return self.voltage if self.power_on else 0.0
+
+    def target_rpm(self):
+        if self.volt() < self.start_volt:
+            return 0.0
+        # the fan controller treats a missing PWM signal as full speed
+        duty = self.duty if self.pwm_on else 100.0
+        ratio = self.min_rpm_ratio + (1.0 - self.min_rpm_ratio) * duty / 100.0
+        return self.max_rpm * ratio * self.volt() / self.rated_volt
+
+    def _rpm(self, t: float):
+        target = self.target_rpm()
+        return target + (self.change_rpm - target) * math.exp(-max(t - self.change_time, 0.0) / self.tau)
+
+    def rpm(self, t: float = None):
+        with self.lock:
+            return self._rpm(time.monotonic() if t is None else t)
+
+    def current(self, t: float = None):
+        ''' mean current at time t, including the inrush after power on '''
+        with self.lock:
+            t = time.monotonic() if t is None else t
+            if not self.power_on:
+                return 0.0
+            steady = self.idle_current + self.rated_current * (self._rpm(t) / self.max_rpm) ** 2
+            since_on = t - self.power_on_time
+            if since_on >= 0 and self.volt() >= self.start_volt:
+                steady += self.rated_current * (self.inrush - 1.0) * math.exp(-since_on / 0.05)
+            return min(steady, self.current_limit)
+
+    def peak_current(self):
+        ''' maximum current of the start up '''
+        with self.lock:
+            if self.volt() < self.start_volt:
+                return self.idle_current
+            return min(self.idle_current + self.rated_current * self.inrush, self.current_limit)
+
+    def state(self):
+        ''' values seen by the oscilloscope at this moment '''
+        rpm = self.rpm()
+        return {'volt': self.volt(), 'duty': self.duty if self.pwm_on else None,
+                'frequency': rpm * self.fg / 60.0, 'current': self.current()}
+
+    def jitter(self, value: float):
+        return value * (1.0 + self.random.normal(0.0, self.noise)) if self.noise else value
+
+class SimResource:
+    '''
+    Base of the simulated instruments, same interface as pyvisa message based resource.
+    Subclass defines idn, latency and the command table.
+    '''
+    idn = ''
+    latency = {'write': 0.001, 'query': 0.002, 'byte': 1 / 20e6}
+    '''
+    seconds of each message ('write' and 'query'), of each transferred byte ('byte'),
+    and the extra time of the commands named in the command table
+    '''
+
+    def __init__(self, address: str, fan: FanModel, latency_scale: float = 1.0, latency: dict = None):
+        self.resource_name = address
+        self.fan = fan
+        self.latency = dict(type(self).latency)
+        self.latency.update(latency or {})
+        self.latency_scale = latency_scale
+        self.timeout = 2000 # ms
+        self.encoding = 'ascii'
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.query_termination = '\n'
+        self.settings = dict() # settings without special handling, key: upper case header
+        self.errors = list()
+        self.esr = 0
+        self.busy_until = 0.0 # monotonic time the overlapped commands finish, *OPC? waits for it
+        self.read_buffer = None
+        self.commands = [(header(spec), handler, key) for spec, handler, key in self.commandTable()]
+        self.write_count = 0
+        self.query_count = 0
+
+    def commandTable(self):
+        '''
+        list of tuple(header spec, handler(numbers, is_query, argument), latency key or None)
+        '''
+        return [('*IDN', self.idnCommand, None),
+                ('*CLS', self.clsCommand, None),
+                ('*RST', self.rstCommand, 'rst'),
+                ('*OPC', self.opcCommand, None),
+                ('*ESR', self.esrCommand, None),
+                ('SYSTem:ERRor', self.errorCommand, None),
+                ('ALLEv', self.allevCommand, None)]
+
+    # visa resource interface
+    def write(self, message: str):
+        self.write_count += 1
+        self.delay('write', len(message))
+        response = self.execute(message)
+        if response is not None:
+            self.read_buffer = response
+        return len(message)
+
+    def query(self, message: str):
+        self.query_count += 1
+        self.delay('query', len(message))
+        response = self.execute(message)
+        if response is None:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        self.delay(None, len(response))
+        if self.read_termination:
+            return response
+        return response + '\n'
+
+    def read(self):
+        return self.read_raw().decode(self.encoding)
+
+    def read_raw(self, size: int = None):
+        if self.read_buffer is None:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        data = self.read_buffer
+        self.read_buffer = None
+        if isinstance(data, str):
+            data = (data + '\n').encode(self.encoding)
+        elif isinstance(data, bytes):
+            data = data + b'\n'
+        self.delay(None, len(data))
+        return data
+
+    def query_binary_values(self, message: str, datatype: str = 'f', is_big_endian: bool = False, container = list, **kwargs):
+        self.query_count += 1
+        self.delay('query', len(message))
+        data = self.execute(message)
+        if data is None:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        data = np.asarray(data).astype(np.dtype(datatype).newbyteorder('>' if is_big_endian else '<'))
+        self.delay(None, data.nbytes)
+        return container(data)
+
+    def clear(self):
+        self.read_buffer = None
+
+    def close(self):
+        pass
+
+    # simulation
+    def delay(self, key: str, size: int = 0):
+        seconds = (self.latency.get(key, 0.0) if key else 0.0) + self.latency['byte'] * size
+        if seconds > 0 and self.latency_scale > 0:
+            time.sleep(seconds * self.latency_scale)
+
+    def busy(self, key: str):
+        ''' overlapped command, *OPC? waits until it is done '''
+        seconds = self.latency.get(key, 0.0) * self.latency_scale
+        self.busy_until = max(self.busy_until, time.monotonic()) + seconds
+
+    def execute(self, message: str):
+        ''' run the commands of a compound message, return the joined responses of the queries or None '''
+        responses = []
+        for command in message.strip().split(';'):
+            command = command.strip()
+            if not command:
+                continue
+            response = self.executeOne(command)
+            if response is not None:
+                responses.append(response)
+        if len(responses) == 0:
+            return None
+        if len(responses) == 1:
+            return responses[0]
+        if any(isinstance(r, np.ndarray) for r in responses):
+            # a curve after other queries, the binary block follows the text responses
+            return b';'.join(self.block(r) if isinstance(r, np.ndarray) else str(r).encode(self.encoding) for r in responses)
+        return ';'.join(str(r) for r in responses)
+
+    def block(self, data: np.ndarray):
+        ''' IEEE 488.2 definite length block of the array '''
+        raw = data.tobytes()
+        size = str(len(raw))
+        return ('#%d%s'%(len(size), size)).encode(self.encoding) + raw
+
+    def executeOne(self, command: str):
+        for regex, handler, key in self.commands:
+            match = regex.match(command)
+            if match is None:
+                continue
+            *numbers, query, argument = match.groups()
+            if key is not None:
+                self.busy(key)
+            return handler([int(n) for n in numbers], query is not None, argument.strip() if argument else None)
+        # settings without special handling
+        head, _, argument = command.partition(' ')
+        head = head.lstrip(':').upper()
+        if head.endswith('?'):
+            if head[:-1] in self.settings:
+                return self.settings[head[:-1]]
+            self.errors.append('-113,"Undefined header; %s"'%command)
+            self.esr |= 0x20 # command error
+            return '0'
+        self.settings[head] = argument.strip()
+        return None
+
+    def number(self, argument: str):
+        ''' parse numeric argument with unit suffix, ex: 2.5V, 5VPP, 25E3 '''
+        return float(re.match(r'^[-+]?[\d.]+(?:[eE][-+]?\d+)?', argument).group())
+
+    def idnCommand(self, numbers, query, argument):
+        return self.idn
+
+    def clsCommand(self, numbers, query, argument):
+        self.esr = 0
+        self.errors.clear()
+
+    def rstCommand(self, numbers, query, argument):
+        self.settings.clear()
+
+    def opcCommand(self, numbers, query, argument):
+        if not query:
+            self.esr |= 0x01 # operation complete
+            return None
+        wait = self.busy_until - time.monotonic()
+        if wait > self.timeout / 1000:
+            time.sleep(self.timeout / 1000)
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        if wait > 0:
+            time.sleep(wait)
+        return '1'
+
+    def esrCommand(self, numbers, query, argument):
+        esr, self.esr = self.esr, 0
+        return str(esr)
+
+    def errorCommand(self, numbers, query, argument):
+        if self.errors:
+            return self.errors.pop(0)
+        return '0,"No error"'
+
+    def allevCommand(self, numbers, query, argument):
+        errors, self.errors = self.errors, []
+        return ','.join(errors) if errors else '0,"No events to report - queue empty"'
+
+class SimPowerSupply(SimResource):
+    idn = 'CHROMA,62012P-80-60,03.30.1,05648'
+    latency = {'write': 0.005, 'query': 0.01, 'byte': 1 / 1e6, 'rst': 0.3}
+
+    def commandTable(self):
+        return super().commandTable() + [
+            ('SOURce:VOLTage', self.voltCommand, None),
+            ('SOURce:CURRent', self.currCommand, None),
+            ('CONFigure:OUTPut', self.outputCommand, None),
+            ('MEASure:VOLTage', self.measVoltCommand, None),
+            ('MEASure:CURRent', self.measCurrCommand, None)]
+
+    def rstCommand(self, numbers, query, argument):
+        super().rstCommand(numbers, query, argument)
+        self.fan.set(voltage=0.0, power_on=False)
+
+    def voltCommand(self, numbers, query, argument):
+        if query:
+            return '%.3f'%self.fan.voltage
+        self.fan.set(voltage=self.number(argument))
+
+    def currCommand(self, numbers, query, argument):
+        if query:
+            return '%.3f'%self.fan.current_limit
+        self.fan.set(current_limit=self.number(argument))
+
+    def outputCommand(self, numbers, query, argument):
+        if query:
+            return 'ON' if self.fan.power_on else 'OFF'
+        self.fan.set(power_on=argument.upper() in ('ON', '1'))
+
+    def measVoltCommand(self, numbers, query, argument):
+        return '%.3f'%self.fan.volt()
+
+    def measCurrCommand(self, numbers, query, argument):
+        return '%.4f'%self.fan.jitter(self.fan.current())
+
+class SimSignalGenerator(SimResource):
+    idn = 'TEKTRONIX,AFG31052,C013019,SCPI:99.0 FV:1.5.2'
+    latency = {'write': 0.002, 'query': 0.003, 'byte': 1 / 20e6, 'rst': 0.5, 'duty': 0.02}
+
+    def commandTable(self):
+        return super().commandTable() + [
+            ('SOURce1:PULSe:DCYCle', self.dutyCommand, 'duty'),
+            ('OUTPut1:STATe', self.outputCommand, None)]
+
+    def rstCommand(self, numbers, query, argument):
+        super().rstCommand(numbers, query, argument)
+        self.fan.set(duty=50.0, pwm_on=False)
+
+    def dutyCommand(self, numbers, query, argument):
+        if query:
+            return '%.3f'%self.fan.duty
+        duty = self.number(argument)
+        self.fan.set(duty=0.0 if duty < 1.0 else min(duty, 100.0))
+
+    def outputCommand(self, numbers, query, argument):
+        if query:
+            return '1' if self.fan.pwm_on else '0'
+        self.fan.set(pwm_on=argument.upper() in ('ON', '1'))
+
+class SimOscilloscope(SimResource):
+    idn = 'TEKTRONIX,MSO46,C033493,CF:91.1CT FV:1.44.3.433'
+    latency = {'write': 0.001, 'query': 0.002, 'byte': 1 / 30e6, 'rst': 1.5, 'autoset': 2.5,
+               'measurement': 0.05, 'save_image': 0.6, 'save_waveform': 1.5}
+    zero = '9.91E+37' # the oscilloscope zero
+    png = bytes.fromhex('89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+                        '0000000d4944415478da63f8cfc0f01f0005000201a3a1b6e20000000049454e44ae426082')
+
+    def __init__(self, address: str, fan: FanModel, latency_scale: float = 1.0, latency: dict = None):
+        super().__init__(address, fan, latency_scale, latency)
+        self.files = dict() # files on the harddrive
+        self.reset()
+
+    def reset(self):
+        self.scale = {1: 1.0, 2: 1.0, 3: 1.0, 4: 1.0} # vertical scale per division
+        self.position = {1: 0.0, 2: 0.0, 3: 0.0, 4: 0.0} # vertical position in division
+        self.horizontal_scale = 1e-3
+        self.horizontal_position = 50.0
+        self.sample_rate = 1e6
+        self.measurements = dict() # key: badge number, value: [type, channel]
+        self.immediate = ['MEAN', 1]
+        self.data = {'source': 1, 'start': 1, 'stop': 10000, 'width': 1}
+        self.stop_after = 'RUNSTOP'
+        self.trigger_mode = 'AUTO'
+        self.running = True
+        self.armed_time = None # monotonic time of starting a single sequence
+        self.frozen = None # fan state when the acquisition stopped
+        self.captured_peak = None # start up current captured by the single sequence
+
+    def commandTable(self):
+        return super().commandTable() + [
+            ('ACQuire:STATE', self.acqStateCommand, None),
+            ('ACQuire:STOPAfter', self.stopAfterCommand, None),
+            ('AUTOSet', self.autosetCommand, 'autoset'),
+            ('HORizontal:SCAle', self.horizontalScaleCommand, None),
+            ('HORizontal:POSition', self.horizontalPositionCommand, None),
+            ('HORizontal:MODe:SAMPLERate', self.sampleRateCommand, None),
+            ('HORizontal:RECOrdlength', self.recordLengthCommand, None),
+            ('DISplay:WAVEView1:CH#:VERTical:SCAle', self.verticalScaleCommand, None),
+            ('DISplay:WAVEView1:CH#:VERTical:POSition', self.verticalPositionCommand, None),
+            ('TRIGger:A:MODe', self.triggerModeCommand, None),
+            ('TRIGger:STATE', self.triggerStateCommand, None),
+            ('MEASUrement:MEAS#:TYPe', self.measTypeCommand, 'measurement'),
+            ('MEASUrement:MEAS#:SOUrce', self.measSourceCommand, 'measurement'),
+            ('MEASUrement:MEAS#:RESUlts:CURRentacq:MEAN', self.measResultCommand, None),
+            ('MEASUrement:DELETEALL', self.deleteAllCommand, None),
+            ('MEASUrement:DELete', self.deleteCommand, None),
+            ('MEASUrement:IMMed:TYPe', self.immedTypeCommand, None),
+            ('MEASUrement:IMMed:SOUrce', self.immedSourceCommand, None),
+            ('MEASUrement:IMMed:VALue', self.immedValueCommand, None),
+            ('DATa:SOUrce', self.dataSourceCommand, None),
+            ('DATa:STARt', self.dataStartCommand, None),
+            ('DATa:STOP', self.dataStopCommand, None),
+            ('WFMOutpre:BYT_Nr', self.byteCommand, None),
+            ('WFMOutpre:XINcr', self.xincrCommand, None),
+            ('WFMOutpre:XZEro', self.xzeroCommand, None),
+            ('WFMOutpre:YMUlt', self.ymultCommand, None),
+            ('WFMOutpre:YZEro', self.yzeroCommand, None),
+            ('WFMOutpre:YOFf', self.yoffCommand, None),
+            ('WFMOutpre:YUNit', self.yunitCommand, None),
+            ('WFMInpre:YUNit', self.yunitCommand, None),
+            ('CURVe', self.curveCommand, None),
+            ('SAVe:IMAGe', self.saveImageCommand, 'save_image'),
+            ('SAVe:WAVEform', self.saveWaveformCommand, 'save_waveform'),
+            ('FILESystem:READFile', self.readFileCommand, None),
+            ('FILESystem:DELEte', self.deleteFileCommand, None)]
+
+    # acquisition
+    def record_length(self):
+        return max(1000, int(round(self.sample_rate * self.horizontal_scale * 10)))
+
+    def acquisition(self):
+        ''' fan state of the displayed acquisition '''
+        if self.running or self.frozen is None:
+            return self.fan.state()
+        return self.frozen
+
+    def sequence_done_time(self):
+        ''' monotonic time the single sequence finishes, None if not triggered yet '''
+        if self.armed_time is None or self.fan.power_on_time < self.armed_time:
+            return None
+        post_trigger = self.horizontal_scale * 10 * (1.0 - self.horizontal_position / 100.0)
+        return self.fan.power_on_time + post_trigger
+
+    def update_sequence(self):
+        ''' stop the acquisition when the single sequence is finished '''
+        if self.armed_time is None or not self.running:
+            return
+        done = self.sequence_done_time()
+        if done is not None and time.monotonic() >= done:
+            self.running = False
+            self.frozen = self.fan.state()
+            self.captured_peak = self.fan.peak_current()
+            self.armed_time = None
+
+    def acqStateCommand(self, numbers, query, argument):
+        self.update_sequence()
+        if query:
+            return '1' if self.running else '0'
+        if argument.upper() in ('1', 'ON', 'RUN'):
+            self.running = True
+            self.frozen = None
+            self.captured_peak = None
+            if self.stop_after == 'SEQUENCE':
+                self.armed_time = time.monotonic()
+                # *OPC? waits for the sequence, until trigger it is only known to take longer than the timeout
+                self.busy_until = math.inf
+        else:
+            if self.running:
+                self.frozen = self.fan.state()
+            self.running = False
+            self.armed_time = None
+            self.busy_until = 0.0
+
+    def opcCommand(self, numbers, query, argument):
+        if self.armed_time is not None:
+            done = self.sequence_done_time()
+            self.busy_until = math.inf if done is None else done
+        response = super().opcCommand(numbers, query, argument)
+        self.update_sequence()
+        return response
+
+    def stopAfterCommand(self, numbers, query, argument):
+        if query:
+            return self.stop_after
+        self.stop_after = 'SEQUENCE' if argument.upper().startswith('SEQ') else 'RUNSTOP'
+
+    def autosetCommand(self, numbers, query, argument):
+        pass
+
+    def rstCommand(self, numbers, query, argument):
+        super().rstCommand(numbers, query, argument)
+        self.reset()
+
+    def horizontalScaleCommand(self, numbers, query, argument):
+        if query:
+            return '%g'%self.horizontal_scale
+        self.horizontal_scale = self.number(argument)
+
+    def horizontalPositionCommand(self, numbers, query, argument):
+        if query:
+            return '%g'%self.horizontal_position
+        self.horizontal_position = self.number(argument)
+
+    def sampleRateCommand(self, numbers, query, argument):
+        if query:
+            return '%g'%self.sample_rate
+        self.sample_rate = self.number(argument)
+
+    def recordLengthCommand(self, numbers, query, argument):
+        return str(self.record_length())
+
+    def verticalScaleCommand(self, numbers, query, argument):
+        if query:
+            return '%g'%self.scale[numbers[0]]
+        self.scale[numbers[0]] = self.number(argument)
+
+    def verticalPositionCommand(self, numbers, query, argument):
+        if query:
+            return '%g'%self.position[numbers[0]]
+        self.position[numbers[0]] = self.number(argument)
+
+    def triggerModeCommand(self, numbers, query, argument):
+        if query:
+            return self.trigger_mode
+        self.trigger_mode = argument.upper()
+
+    def triggerStateCommand(self, numbers, query, argument):
+        self.update_sequence()
+        if self.armed_time is not None:
+            # armed at once, ready for the trigger event
+            return 'READY'
+        if not self.running:
+            return 'SAVE'
+        return 'AUTO' if self.trigger_mode == 'AUTO' else 'TRIGGER'
+
+    # measurement
+    def measure(self, type: str, channel: int):
+        ''' value of the measurement type on the displayed acquisition, as oscilloscope string '''
+        self.update_sequence()
+        state = self.acquisition()
+        type = type.upper()
+        value = 0.0
+        if channel == 1:
+            value = state['volt']
+        elif channel == 2:
+            if state['duty'] is not None:
+                value = {'PDUTY': state['duty'], 'FREQUENCY': 25e3}.get(type, 5.0 * state['duty'] / 100.0)
+        elif channel == 3:
+            frequency = state['frequency']
+            value = {'FREQUENCY': frequency, 'PDUTY': 50.0 if frequency > 0 else 0.0}.get(type, 2.5 if frequency > 0 else 0.0)
+        elif channel == 4:
+            mean = state['current']
+            if type == 'MAXIMUM':
+                value = self.captured_peak if self.captured_peak is not None else mean * 1.15
+            elif type == 'RMS':
+                value = mean * 1.01
+            elif type == 'PK2PK':
+                value = mean * 0.3
+            else:
+                value = mean
+        if value == 0.0 and type in ('FREQUENCY', 'PDUTY'):
+            return self.zero
+        return '%.6E'%self.fan.jitter(value)
+
+    def measTypeCommand(self, numbers, query, argument):
+        badge = self.measurements.setdefault(numbers[0], ['MEAN', 1])
+        if query:
+            return badge[0]
+        badge[0] = argument.upper()
+
+    def measSourceCommand(self, numbers, query, argument):
+        badge = self.measurements.setdefault(numbers[0], ['MEAN', 1])
+        if query:
+            return 'CH%d'%badge[1]
+        badge[1] = int(argument.upper().replace('CH', ''))
+
+    def measResultCommand(self, numbers, query, argument):
+        if numbers[0] not in self.measurements:
+            self.errors.append('-224,"Illegal parameter value; MEAS%d"'%numbers[0])
+            self.esr |= 0x10 # execution error
+            return self.zero
+        return self.measure(*self.measurements[numbers[0]])
+
+    def deleteAllCommand(self, numbers, query, argument):
+        self.measurements.clear()
+
+    def deleteCommand(self, numbers, query, argument):
+        self.measurements.pop(int(re.sub(r'\D', '', argument)), None)
+
+    def immedTypeCommand(self, numbers, query, argument):
+        self.immediate[0] = argument.upper()
+
+    def immedSourceCommand(self, numbers, query, argument):
+        # queryMeasurement sends the source as 'CH<n>', keep only the channel number
+        self.immediate[1] = int(re.sub(r'\D', '', argument) or 1)
+
+    def immedValueCommand(self, numbers, query, argument):
+        return self.measure(*self.immediate)
+
+    # waveform transfer
+    def level_factor(self):
+        return 25.0 if self.data['width'] == 1 else 6400.0
+
+    def dataSourceCommand(self, numbers, query, argument):
+        if query:
+            return 'CH%d'%self.data['source']
+        self.data['source'] = int(re.sub(r'\D', '', argument))
+
+    def dataStartCommand(self, numbers, query, argument):
+        if query:
+            return str(self.data['start'])
+        self.data['start'] = int(self.number(argument))
+
+    def dataStopCommand(self, numbers, query, argument):
+        if query:
+            return str(self.data['stop'])
+        self.data['stop'] = int(self.number(argument))
+
+    def byteCommand(self, numbers, query, argument):
+        if query:
+            return str(self.data['width'])
+        self.data['width'] = int(self.number(argument))
+
+    def xincrCommand(self, numbers, query, argument):
+        return '%.6E'%(1.0 / self.sample_rate)
+
+    def xzeroCommand(self, numbers, query, argument):
+        return '%.6E'%(-self.horizontal_scale * 10 * self.horizontal_position / 100.0)
+
+    def ymultCommand(self, numbers, query, argument):
+        return '%.6E'%(self.scale[self.data['source']] / self.level_factor())
+
+    def yzeroCommand(self, numbers, query, argument):
+        return '0.0E+0'
+
+    def yoffCommand(self, numbers, query, argument):
+        return '%.6E'%(-self.position[self.data['source']] * self.level_factor())
+
+    def yunitCommand(self, numbers, query, argument):
+        return '"A"' if self.data['source'] == 4 else '"V"'
+
+    def waveform(self, channel: int, start: int, stop: int):
+        ''' scaled samples [start, stop) of the channel, time 0 at the trigger point '''
+        dt = 1.0 / self.sample_rate
+        t = -self.horizontal_scale * 10 * self.horizontal_position / 100.0 + np.arange(start, stop) * dt
+        fan = self.fan
+        state = self.acquisition()
+        frequency = state['frequency']
+        if channel == 1:
+            wave = np.full(t.size, state['volt'])
+        elif channel == 2:
+            wave = ((t * 25e3) % 1.0 < state['duty'] / 100.0) * 5.0 if state['duty'] is not None else np.zeros(t.size)
+        elif channel == 3:
+            wave = ((t * frequency) % 1.0 < 0.5) * 5.0 if frequency > 0 else np.full(t.size, 5.0)
+        else:
+            mean = state['current']
+            wave = mean * (1.0 + 0.15 * np.sin(2 * np.pi * frequency * t))
+            if self.captured_peak is not None:
+                # single sequence triggered by power on
+                wave = np.where(t < 0, 0.0, mean + (self.captured_peak - mean) * np.exp(-np.maximum(t, 0) / 0.05))
+        if fan.noise:
+            wave = wave + fan.random.normal(0.0, fan.noise * self.scale[channel], t.size)
+        return wave
+
+    def curveCommand(self, numbers, query, argument):
+        length = self.record_length()
+        start = max(1, self.data['start'])
+        stop = min(length, self.data['stop'])
+        channel = self.data['source']
+        levels = self.waveform(channel, start - 1, stop) / (self.scale[channel] / self.level_factor()) - self.position[channel] * self.level_factor()
+        limit = 127 if self.data['width'] == 1 else 32767
+        return np.clip(np.round(levels), -limit - 1, limit).astype(np.int8 if self.data['width'] == 1 else np.int16)
+
+    # file system
+    def saveImageCommand(self, numbers, query, argument):
+        self.files[argument.strip('\'"').upper()] = self.png
+
+    def saveWaveformCommand(self, numbers, query, argument):
+        source, _, file_name = argument.partition(',')
+        file_name = file_name.strip('\'"').upper()
+        length = self.record_length()
+        t = np.arange(length) / self.sample_rate
+        columns = [t] + [self.waveform(channel, 0, length) for channel in (1, 2, 3, 4)]
+        rows = np.column_stack(columns)
+        text = 'TIME,CH1,CH2,CH3,CH4\n' + ('%.9g,%.4g,%.4g,%.4g,%.4g\n' * length) % tuple(rows.ravel().tolist())
+        self.files[file_name.replace('.CSV', '_ALL.CSV')] = text.encode('latin_1')
+
+    def readFileCommand(self, numbers, query, argument):
+        file_name = argument.strip('\'"').upper()
+        if file_name not in self.files:
+            self.errors.append('-256,"File name not found; %s"'%file_name)
+            self.esr |= 0x10
+            return None
+        self.read_buffer = self.files[file_name]
+
+    def deleteFileCommand(self, numbers, query, argument):
+        self.files.pop(argument.strip('\'"').upper(), None)
+
+class ResourceManager:
+    '''
+    Stand-in of pyvisa.ResourceManager serving the simulated benches
+    '''
+    def __init__(self, benches: int = 1, latency_scale: float = 1.0, latency: dict = None, fan: dict = None, seed: int = None):
+        '''
+        Args:
+            benches (int): number of (oscilloscope, power supply, signal generator) sets
+            latency_scale (float): multiply every latency, 0 for no delay
+            latency (dict): key: instrument class name (ex: 'SimOscilloscope'), value: dict overriding its latency
+            fan (dict): keyword arguments of FanModel
+            seed (int): seed of the measurement noise
+        '''
+        latency = latency or {}
+        self.resources = dict()
+        for i in range(benches):
+            fan_model = FanModel(seed=None if seed is None else seed + i, **(fan or {}))
+            suffix = '' if i == 0 else '_%d'%i
+            for address, cls in ((OSC_ADDRESS, SimOscilloscope), (POWER_ADDRESS, SimPowerSupply), (SIGNAL_ADDRESS, SimSignalGenerator)):
+                address = address.replace('::INSTR', suffix + '::INSTR')
+                resource = cls(address, fan_model, latency_scale, latency.get(cls.__name__))
+                if i > 0:
+                    resource.idn = resource.idn + suffix # distinct id for each bench
+                self.resources[address] = resource
+
+    def list_resources(self, query: str = '?*::INSTR'):
+        return tuple(self.resources.keys())
+
+    def open_resource(self, resource_name: str, **kwargs):
+        if resource_name not in self.resources:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        return self.resources[resource_name]
+
+    def close(self):
+        pass
@@ -0,0 +1,177 @@
+'''
+Trace of the SCPI I/O of every instrument, for finding where the test time goes.
+
+InstrumentSession reports each write, query, read_raw and binary query to the module tracer,
+which keeps the latest records in a ring buffer, a latency histogram per command and the I/O time of
+each Controller job. When the tracer is disabled the session only checks one attribute.
+
+Typical usage:
+    tracing.tracer.enable('trace.json')     # dumped by Controller.stop, or call tracing.tracer.dump()
+    with tracing.tracer.job('maxCurrent'):  # commands of the thread are attributed to the job
+        ...
+    print(tracing.tracer.summary())
+'''
+import bisect
+import collections
+import contextlib
+import csv
+import json
+import re
+import threading
+import time
+
+def command_key(message: str):
+    ''' group commands by header, ex: 'MEASUrement:MEAS3:TYPe MEAN' -> 'MEASUREMENT:MEAS#:TYPE' '''
+    headers = []
+    for command in message.strip().split(';'):
+        head = command.strip().split(' ', 1)[0].lstrip(':').upper()
+        if head:
+            headers.append(re.sub(r'\d+', '#', head))
+    return ';'.join(headers)
+
+class Histogram:
+    '''
+    latency histogram with log spaced bins, 4 bins per decade from 10 us to 100 s
+    '''
+    edges = [10 ** (e / 4) for e in range(-20, 9)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect.bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float):
+        ''' upper edge of the bin holding the p-th percentile, clipped to the max '''
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.edges[i] if i < len(self.edges) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'min': self.min if self.count else 0.0, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+class Tracer:
+    '''
+    collect the I/O records of all instruments, thread safe
+    '''
+    fields = ('time', 'thread', 'job', 'instrument', 'operation', 'command', 'bytes', 'duration')
+
+    def __init__(self, capacity: int = 100000):
+        self.enabled = False
+        self.file_name = None # dump file at stop, .json or .csv
+        self.records = collections.deque(maxlen=capacity)
+        self.histograms = dict() # key: (instrument, command key)
+        self.jobs = dict() # key: job name, value: {'runs', 'seconds', 'io_count', 'io_seconds'}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self, file_name: str = None, capacity: int = None):
+        if capacity is not None:
+            self.records = collections.deque(self.records, maxlen=capacity)
+        self.file_name = file_name
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.histograms.clear()
+            self.jobs.clear()
+            self.origin = time.perf_counter()
+
+    def currentJob(self):
+        return getattr(self.local, 'job', None)
+
+    def setJob(self, name: str):
+        ''' attribute the commands of this thread to the job, ex: on an instrument worker running a job's command '''
+        self.local.job = name
+
+    @contextlib.contextmanager
+    def job(self, name: str):
+        ''' attribute the commands of this thread to the job and record its duration '''
+        previous = self.currentJob()
+        self.local.job = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.job = previous
+            if self.enabled:
+                with self.lock:
+                    stat = self.jobStat(name)
+                    stat['runs'] += 1
+                    stat['seconds'] += time.perf_counter() - start
+
+    def jobStat(self, name: str):
+        if name not in self.jobs:
+            self.jobs[name] = {'runs': 0, 'seconds': 0.0, 'io_count': 0, 'io_seconds': 0.0}
+        return self.jobs[name]
+
+    def record(self, instrument: str, operation: str, command: str, size: int, start: float):
+        ''' add one I/O, start is the time.perf_counter() before the I/O '''
+        end = time.perf_counter()
+        duration = end - start
+        job = self.currentJob()
+        with self.lock:
+            self.records.append((start - self.origin, threading.current_thread().name, job, instrument,
+                                 operation, command, size, duration))
+            key = (instrument, command_key(command))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(duration)
+            if job is not None:
+                stat = self.jobStat(job)
+                stat['io_count'] += 1
+                stat['io_seconds'] += duration
+
+    def ioCount(self):
+        with self.lock:
+            return sum(h.count for h in self.histograms.values())
+
+    def summary(self):
+        ''' per command latency statistics and per job time, sorted by total time '''
+        with self.lock:
+            commands = [dict(instrument=instrument, command=command, **h.summary())
+                        for (instrument, command), h in self.histograms.items()]
+            jobs = {name: dict(stat) for name, stat in self.jobs.items()}
+        commands.sort(key=lambda c: c['total'], reverse=True)
+        return {'commands': commands, 'jobs': jobs}
+
+    def dump(self, file_name: str = None):
+        '''
+        save the trace, .csv for the records in the ring buffer,
+        .json for the summary and the records
+        '''
+        file_name = file_name or self.file_name
+        with self.lock:
+            records = list(self.records)
+        if file_name.lower().endswith('.csv'):
+            with open(file_name, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.fields)
+                writer.writerows(records)
+        else:
+            data = self.summary()
+            data['records'] = [dict(zip(self.fields, r)) for r in records]
+            with open(file_name, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=1)
+        print('trace saved: ' + file_name)
+
+tracer = Tracer()
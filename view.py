@@ -30,6 +30,14 @@ Typical usage example:
 
 import PySimpleGUI as sg
 from enum import Enum
+import queue
+import threading
+import time
+import numpy as np # http://www.numpy.org/
+from matplotlib.figure import Figure # http://matplotlib.org/
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import waveform
+import gui_log
 
 class InstrumentOption:
     """Class that encapsulates information about instrument parameters to present on GUI.
@@ -195,17 +203,190 @@ def Collapsible(layout, key, title='', arrows=(sg.SYMBOL_DOWN, sg.SYMBOL_UP), co
                        sg.T(title, enable_events=True, key=key+'-TITLE-')],
                       [sg.pin(sg.Column(layout, key=key, visible=not collapsed, metadata=arrows))]], pad=(0,0))
 
+class LivePlot:
+    """
+    Waveform of the last acquisition and RPM/current trend of the test on a matplotlib figure.
+    The lines are animated: a refresh only draws them over the saved background (blitting),
+    the axes are drawn again only when the data leaves the limits.
+    Long series are decimated to max_points, so the cost of a refresh does not grow with the test time.
+    """
+    def __init__(self, master = None, size:tuple = (6, 4), max_points:int = 1000, min_interval:float = 0.2):
+        '''
+        Parameters
+        ----------
+        master : tkinter widget to embed the figure, None for an off-screen canvas
+        size : figure size in inches
+        max_points : points drawn of each line
+        min_interval : seconds between refreshes
+        '''
+        self.max_points = max_points
+        self.min_interval = min_interval
+        self.figure = Figure(figsize=size, dpi=100, layout='constrained')
+        self.wave_ax = self.figure.add_subplot(2, 1, 1)
+        self.wave_ax.set_xlabel('time (s)')
+        self.wave_ax.set_ylabel('V')
+        self.wave_current_ax = self.wave_ax.twinx()
+        self.wave_current_ax.set_ylabel('A')
+        self.trend_ax = self.figure.add_subplot(2, 1, 2)
+        self.trend_ax.set_xlabel('test time (s)')
+        self.trend_ax.set_ylabel('RPM')
+        self.trend_current_ax = self.trend_ax.twinx()
+        self.trend_current_ax.set_ylabel('A')
+        self.rpm_line, = self.trend_ax.plot([], [], 'C0', animated=True)
+        self.current_line, = self.trend_current_ax.plot([], [], 'C3', animated=True)
+        self.wave_lines = {} # key: channel name, value: line
+        # trend samples, columns: time, RPM, current
+        self.trend = np.empty((1024, 3))
+        self.count = 0
+        self.start = None
+        if master is None:
+            self.canvas = FigureCanvasAgg(self.figure)
+        else:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            self.canvas = FigureCanvasTkAgg(self.figure, master)
+            self.canvas.get_tk_widget().pack(side='top', fill='both', expand=True)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.full = True # the axes are drawn again on the next refresh
+        self.dirty = False # the lines changed since the last refresh
+        self.last_refresh = 0.0
+
+    def onDraw(self, event):
+        # background without the animated lines, they are drawn on the next refresh
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.dirty = True
+
+    def lines(self):
+        return [self.rpm_line, self.current_line] + list(self.wave_lines.values())
+
+    def setWaveform(self, waves:dict):
+        '''
+        show the curves of one acquisition
+        :param waves: key: channel (Enum), value: tuple(scaled wave, seconds per sample), as Oscilloscope.acquireWaveforms()
+        '''
+        for channel, (wave, dt) in waves.items():
+            name = getattr(channel, 'name', str(channel))
+            ax = self.wave_current_ax if name == 'current' else self.wave_ax
+            if name not in self.wave_lines:
+                self.wave_lines[name], = ax.plot([], [], 'C%d'%(len(self.wave_lines) + 1), animated=True, label=name)
+                # outside the axes, the animated lines are drawn over the background
+                if self.figure.legends:
+                    self.figure.legends[0].remove()
+                self.figure.legend(handles=list(self.wave_lines.values()), loc='outside upper center', ncols=4, fontsize='x-small')
+                self.full = True
+            x, y = waveform.minmax_decimate(np.arange(len(wave)) * dt, wave, self.max_points // 2)
+            self.wave_lines[name].set_data(x, y)
+        # the limits contain every line of the axes
+        for ax in (self.wave_ax, self.wave_current_ax):
+            lines = [line for line in self.wave_lines.values() if line.axes is ax]
+            if lines:
+                self.full |= self.fit(ax, np.concatenate([line.get_xdata() for line in lines]),
+                                      np.concatenate([line.get_ydata() for line in lines]), exact=True)
+        self.dirty = True
+
+    def addTrend(self, rpm:float, current:float, t:float = None):
+        '''
+        add a sample of the trend, t in monotonic seconds, default now
+        '''
+        t = time.monotonic() if t is None else t
+        if self.start is None:
+            self.start = t
+        if self.count == len(self.trend):
+            self.trend = np.concatenate((self.trend, np.empty_like(self.trend)))
+        self.trend[self.count] = (t - self.start, rpm, current)
+        self.count += 1
+        self.dirty = True
+
+    def clearTrend(self):
+        self.count = 0
+        self.start = None
+        self.rpm_line.set_data([], [])
+        self.current_line.set_data([], [])
+        self.dirty = True
+
+    def fit(self, ax, x:np.ndarray, y:np.ndarray, exact:bool = False):
+        '''
+        change the limits of the axes to contain the data, the time axis grows by half of the span to draw the axes less often
+        :param exact: fit the limits to the data, even if they shrink
+        :return: True if the limits are changed
+        '''
+        if len(x) == 0:
+            return False
+        x0, x1 = ax.get_xlim()
+        y0, y1 = ax.get_ylim()
+        xmin, xmax, ymin, ymax = float(np.min(x)), float(np.max(x)), float(np.nanmin(y)), float(np.nanmax(y))
+        if not np.isfinite(ymin):
+            return False
+        margin = max((ymax - ymin) * 0.1, abs(ymax) * 0.05, 1e-3)
+        changed = False
+        if exact:
+            xlim = (xmin, xmax if xmax > xmin else xmin + 1e-9)
+            ylim = (ymin - margin, ymax + margin)
+            if not np.allclose((x0, x1), xlim):
+                ax.set_xlim(*xlim)
+                changed = True
+            # keep the vertical limits if the curve still fills most of them
+            if ymin < y0 or ymax > y1 or (ymax - ymin) < (y1 - y0) * 0.5:
+                ax.set_ylim(*ylim)
+                changed = True
+            return changed
+        if xmin < x0 or xmax > x1:
+            ax.set_xlim(min(xmin, x0), xmax + max(xmax - xmin, 10.0) * 0.5)
+            changed = True
+        if ymin < y0 or ymax > y1:
+            ax.set_ylim(min(ymin - margin, y0), max(ymax + margin, y1))
+            changed = True
+        return changed
+
+    def refresh(self, force:bool = False):
+        '''
+        redraw the changed lines, at most once per min_interval unless force
+        :return: True if drawn
+        '''
+        now = time.monotonic()
+        if not (self.dirty or self.full) or (not force and now - self.last_refresh < self.min_interval):
+            return False
+        self.last_refresh = now
+        if self.count:
+            trend = self.trend[:self.count]
+            x, rpm = waveform.lttb(trend[:, 0], trend[:, 1], self.max_points)
+            self.rpm_line.set_data(x, rpm)
+            self.full |= self.fit(self.trend_ax, x, rpm)
+            x, current = waveform.lttb(trend[:, 0], trend[:, 2], self.max_points)
+            self.current_line.set_data(x, current)
+            self.full |= self.fit(self.trend_current_ax, x, current)
+            # both lines share the time axis
+            self.trend_current_ax.set_xlim(self.trend_ax.get_xlim())
+        if self.full or self.background is None:
+            self.canvas.draw() # saves the background in onDraw
+            self.full = False
+        self.canvas.restore_region(self.background)
+        for line in self.lines():
+            line.axes.draw_artist(line)
+        self.canvas.blit(self.figure.bbox)
+        self.dirty = False
+        return True
+
 class View():
-    def __init__(self, cprint:bool = False, stdout:bool = False, default_filename:str = './report') -> None:
+    def __init__(self, cprint:bool = False, stdout:bool = False, default_filename:str = './report', plot:bool = True,
+                 log_capacity:int = 2000, max_lines:int = 1000, log_interval:float = 0.2) -> None:
         '''
         initial layout of GUI
         
         Parameters
         ----------
         cprint : bool
-            reroute cprint to GUI
+            show the error and success messages on GUI
         stdout : bool
-            reroute stdout to GUI, default False, for ease of log checking when debugging.
+            show stdout on GUI, default False, for ease of log checking when debugging.
+        plot : bool
+            show the live waveform and RPM/current trend
+        log_capacity : int
+            lines kept for the GUI between two refreshes, older lines are only in the log file
+        max_lines : int
+            lines kept in the log pane
+        log_interval : float
+            seconds between refreshes of the log pane
         '''
         sg.theme('Default 1')
         sg.set_options(element_padding=(0, 0))
@@ -224,30 +405,149 @@ class View():
         section2 =  [
             [sg.Column(self.custom_col(c, self.cols, size=(10,1), pad=(1,1))) for c in self.conditions],
         ]
+        self.sec3_key = '-SEC3_KEY-'
+        section3 = [[sg.Canvas(key='-PLOT-', size=(600, 400))]]
         layout = [
                 [Collapsible(section1, key=self.sec1_key, title='Change input instruments and output file directory', collapsed=True)],
                 [Collapsible(section2, key=self.sec2_key, title='Specify Spec', collapsed=True)],     
                 [sg.Submit('    ⏵︎', key='Start'), 
                  sg.Button('    ⏸︎', key='Pause'), 
                  sg.Button('    ⏹︎', key='Stop'), sg.Quit()],
-                [sg.Multiline('Wait for connecting devices...\n', size=(None, 5), expand_y=True, key='Multiline', write_only=True, reroute_cprint=cprint, reroute_stdout=stdout, autoscroll=True)]
+                [sg.Multiline('Wait for connecting devices...\n', size=(None, 5), expand_y=True, key='Multiline', write_only=True, autoscroll=True)]
         ]
+        if plot:
+            layout.insert(2, [Collapsible(section3, key=self.sec3_key, title='Live plot')])
 
-        self.window = sg.Window('Fan assembly auto test', layout, auto_size_buttons=False, keep_on_top=True, grab_anywhere=True)
+        self.window = sg.Window('Fan assembly auto test', layout, auto_size_buttons=False, keep_on_top=True, grab_anywhere=True, finalize=plot)
+        # the figure is embedded in the finalized canvas
+        self.plot = LivePlot(self.window['-PLOT-'].TKCanvas) if plot else None
+        self.plotting = plot
         
+        # the log pane is appended in batches by flushLog()
+        self.cprint = cprint
+        self.max_lines = max_lines
+        self.log_interval = log_interval
+        self.last_log = 0.0
+        self.log = gui_log.GuiLogHandler(log_capacity)
+        shown = [gui_log.view_logger.name] if cprint else []
+        if stdout:
+            shown.append(gui_log.stdout_logger.name)
+        self.log.addFilter(lambda record: record.name in shown)
+        gui_log.logger.addHandler(self.log)
+        # calls from the test sequence thread are run by the event loop, see callOnGui()
+        self.call_key = '-CALL-'
+        self.gui_thread = threading.current_thread()
+        self.call_lock = threading.Lock()
+        self.waiting_calls = dict() # key: reply queue of a waiting call, value: default reply
+        self.closed = False # set by closeCalls(), waiting calls get the default reply
         # set the controller
         self.controller = None
         # set finite state machine initial state
         self.state = View.State.Idle
 
     def getSpecValue(self):
-        event, values = self.window.read(timeout=10)
+        if threading.current_thread() is not self.gui_thread:
+            return self.callOnGui(self.getSpecValue, wait=True, default=[])
         spec = []
         for con in self.conditions:
             for col in self.cols:
-                spec.append(values[(con, col)])
+                spec.append(self.window[(con, col)].get())
         return spec
 
+    def callOnGui(self, function, *args, wait:bool = False, default = None):
+        """
+        run the function on the GUI thread, tkinter is not thread-safe.
+        From another thread the call is posted as an event handled by handleCall() in the event loop.
+        :param wait: block until the function returns and return its result
+        :param default: result of a waiting call when the window is closed before the call is handled
+        """
+        if threading.current_thread() is self.gui_thread:
+            return function(*args)
+        reply = queue.Queue(maxsize=1) if wait else None
+        with self.call_lock:
+            if self.closed:
+                return default
+            if wait:
+                self.waiting_calls[reply] = default
+        self.window.write_event_value(self.call_key, (function, args, reply))
+        if wait:
+            result, error = reply.get()
+            if error is not None:
+                raise error
+            return result
+
+    def handleCall(self, call):
+        """
+        run a call posted by callOnGui()
+        """
+        function, args, reply = call
+        with self.call_lock:
+            if reply is not None and reply not in self.waiting_calls:
+                # already answered by closeCalls()
+                return
+        try:
+            result, error = function(*args), None
+        except Exception as e:
+            result, error = None, e
+            if reply is None:
+                gui_log.view_logger.error(repr(e))
+        if reply is not None:
+            with self.call_lock:
+                self.waiting_calls.pop(reply, None)
+            reply.put((result, error))
+
+    def closeCalls(self):
+        """
+        the event loop ends, answer the waiting calls and the later ones with their default reply
+        """
+        with self.call_lock:
+            self.closed = True
+            for reply, default in self.waiting_calls.items():
+                reply.put((default, None))
+            self.waiting_calls.clear()
+
+    def addTrend(self, rpm:float, current:float):
+        if self.plot is not None:
+            self.callOnGui(self.plot.addTrend, rpm, current, time.monotonic())
+
+    def clearTrend(self):
+        if self.plot is not None:
+            self.callOnGui(self.plot.clearTrend)
+
+    def showWaveform(self, waves:dict):
+        if self.plot is not None:
+            self.callOnGui(self.plot.setWaveform, waves)
+
+    def refreshPlot(self):
+        if self.plot is not None and self.window[self.sec3_key].visible:
+            self.plot.refresh()
+
+    def flushLog(self, force:bool = False):
+        """
+        append the collected log lines to the pane, at most once per log_interval unless force,
+        lines of the same color are appended at once and the oldest lines beyond max_lines are deleted
+        """
+        now = time.monotonic()
+        if not force and now - self.last_log < self.log_interval:
+            return
+        self.last_log = now
+        records = self.log.drain()
+        if not records:
+            return
+        pane = self.window['Multiline']
+        start = 0
+        for i in range(1, len(records) + 1):
+            if i == len(records) or records[i][1] != records[start][1]:
+                pane.print('\n'.join(text for text, color in records[start:i]), text_color=records[start][1])
+                start = i
+        widget = pane.Widget
+        lines = int(widget.index('end-1c').split('.')[0])
+        if lines > self.max_lines:
+            state = widget.cget('state')
+            widget.configure(state='normal')
+            widget.delete('1.0', '%d.0'%(lines - self.max_lines + 1))
+            widget.configure(state=state)
+
     def changeCollapsibleSection(self, event, section_key):
         if event.startswith(section_key):
             self.window[section_key].update(visible=not self.window[section_key].visible)
@@ -431,14 +731,25 @@ class View():
             print("stop: output stop")
             self.controller.stop()
 
+    def askYesNo(self, message):
+        """
+        Popup a yes/no question
+        :return: True if yes is clicked
+        """
+        if threading.current_thread() is not self.gui_thread:
+            return self.callOnGui(self.askYesNo, message, wait=True, default=False)
+        return sg.popup_yes_no(message, keep_on_top=True) == 'Yes'
+
     def show_error(self, message):
         """
         Show an error message
         :param message:
         :return:
         """
-        sg.cprint(message, text_color='red')
-        pass
+        if self.cprint:
+            gui_log.view_logger.error(message)
+        else:
+            print(message)
 
     def show_success(self, message):
         """
@@ -446,12 +757,72 @@ class View():
         :param message:
         :return:
         """
-        sg.cprint(message, text_color='blue')
-        pass
+        if self.cprint:
+            gui_log.view_logger.info(message, extra={'color': 'blue'})
+        else:
+            print(message)
 
     def hide_message(self):
         """
         Hide the message
         :return:
         """
-        pass
\ No newline at end of file
+        pass
+
+class HeadlessView():
+    """
+    Stand-in of View for a test sequence running without window, ex: the stations of a multi-bench test.
+    Questions are asked on the console if interactive, otherwise answered from the given answers.
+    """
+    State = View.State
+    console_lock = threading.Lock() # stations share one console
+    plotting = False
+
+    def __init__(self, name:str = 'station', spec:list = None, answers:dict = None, default_answer:bool = True, interactive:bool = False) -> None:
+        '''
+        Parameters
+        ----------
+        name : str
+            prefix of the printed messages
+        spec : list
+            spec values written to the report, in the order of View.getSpecValue()
+        answers : dict
+            key: question message, value: answer of askYesNo()
+        default_answer : bool
+            answer of the question not in answers
+        interactive : bool
+            ask the question on the console
+        '''
+        self.name = name
+        self.spec = spec if spec is not None else ['0'] * 6
+        self.answers = answers if answers is not None else {}
+        self.default_answer = default_answer
+        self.interactive = interactive
+        self.state = View.State.Idle
+
+    def getSpecValue(self):
+        return list(self.spec)
+
+    def askYesNo(self, message):
+        if self.interactive:
+            with HeadlessView.console_lock:
+                answer = input('%s: %s [y/n] '%(self.name, message))
+            return answer.strip().lower().startswith('y')
+        answer = self.answers.get(message, self.default_answer)
+        print('%s: %s %s'%(self.name, message, 'Yes' if answer else 'No'))
+        return answer
+
+    def show_error(self, message):
+        print('%s: %s'%(self.name, message))
+
+    def show_success(self, message):
+        print('%s: %s'%(self.name, message))
+
+    def addTrend(self, rpm, current):
+        pass
+
+    def clearTrend(self):
+        pass
+
+    def showWaveform(self, waves):
+        pass
@@ -0,0 +1,306 @@
+'''
+Host side measurement and export of the waveform data pulled from the oscilloscope as binary block.
+The measurement functions work on unscaled levels as well as scaled values.
+'''
+import numpy as np # http://www.numpy.org/
+import json
+import os
+import time
+
+def logic_state(wave: np.ndarray, hysteresis: float = 0.1):
+    ''' Threshold a digital like signal (FG, PWM) into high/low state
+    Args:
+        wave (np.ndarray): waveform samples
+        hysteresis (float): ratio of the signal span, the signal has to go below (middle - hysteresis)
+                            to be low and above (middle + hysteresis) to be high, so noise does not toggle the state
+    Returns:
+        np.ndarray: boolean array, True for high, None if the signal is flat
+    '''
+    wave = np.asarray(wave, dtype=np.float64)
+    if wave.size < 2:
+        return None
+    top = wave.max()
+    base = wave.min()
+    if top == base:
+        return None
+    middle = (top + base) / 2
+    high = wave > middle + (top - base) * hysteresis
+    low = wave < middle - (top - base) * hysteresis
+    # hold the last decided state (high or low) through the samples between the thresholds
+    decided = high | low
+    index = np.where(decided, np.arange(wave.size), 0)
+    np.maximum.accumulate(index, out=index)
+    state = high[index] & decided[index]
+    # the samples before the first decided sample have no state
+    state[:np.argmax(decided)] = high[np.argmax(decided)]
+    return state
+
+def rising_edges(wave: np.ndarray, hysteresis: float = 0.1):
+    ''' Find the rising edges of a digital like signal (FG, PWM)
+    Args:
+        wave (np.ndarray): waveform samples
+        hysteresis (float): see logic_state()
+    Returns:
+        np.ndarray: sample index of each rising edge
+    '''
+    state = logic_state(wave, hysteresis)
+    if state is None:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(~state[:-1] & state[1:]) + 1
+
+def frequency(wave: np.ndarray, dt: float, hysteresis: float = 0.1):
+    ''' Frequency from the time between the first and the last rising edge
+    Args:
+        wave (np.ndarray): waveform samples
+        dt (float): seconds per sample
+    Returns:
+        float: frequency in Hz, 0.0 if there are less than 2 edges
+    '''
+    edges = rising_edges(wave, hysteresis)
+    if edges.size < 2:
+        return 0.0
+    return float((edges.size - 1) / ((edges[-1] - edges[0]) * dt))
+
+def scale(level: float, ymult: float, yzero: float, yoff: float):
+    ''' Convert unscaled level to volt or ampere, using the factors of Oscilloscope.curveScale()
+    '''
+    return (level - yoff) * ymult + yzero
+
+def duty_cycle(wave: np.ndarray, hysteresis: float = 0.1):
+    ''' Positive duty cycle over the whole periods between the first and the last rising edge
+    Args:
+        wave (np.ndarray): waveform samples
+    Returns:
+        float: duty cycle in percent, 0.0 for a flat signal
+    '''
+    state = logic_state(wave, hysteresis)
+    if state is None:
+        return 0.0
+    edges = np.flatnonzero(~state[:-1] & state[1:]) + 1
+    if edges.size < 2:
+        # less than one period, use the whole record
+        return float(state.mean()) * 100.0
+    return float(state[edges[0]:edges[-1]].mean()) * 100.0
+
+def statistics(wave: np.ndarray):
+    ''' Amplitude measurements of an analog signal (voltage, current)
+    Args:
+        wave (np.ndarray): scaled waveform samples
+    Returns:
+        dict: MEAN, MAXIMUM, MINIMUM, RMS, PK2PK
+    '''
+    wave = np.asarray(wave, dtype=np.float64)
+    top = float(wave.max())
+    base = float(wave.min())
+    return {'MEAN': float(wave.mean()),
+            'MAXIMUM': top,
+            'MINIMUM': base,
+            'RMS': float(np.sqrt(np.dot(wave, wave) / wave.size)),
+            'PK2PK': top - base}
+
+def top_base(wave: np.ndarray, bins: int = 256):
+    ''' Top and base of a pulse like signal by the histogram method of the oscilloscope, the most common value
+    above and below the middle of the span, so overshoot and ringing do not count
+    Args:
+        wave (np.ndarray): waveform samples
+        bins (int): histogram bins over the span, 256 for the levels of 1 byte samples
+    Returns:
+        tuple: (top, base), (maximum, minimum) for a flat signal
+    '''
+    wave = np.asarray(wave, dtype=np.float64)
+    top = float(wave.max())
+    base = float(wave.min())
+    if top == base:
+        return top, base
+    count, edges = np.histogram(wave, bins=bins, range=(base, top))
+    center = (edges[:-1] + edges[1:]) / 2
+    half = bins // 2
+    return float(center[half + count[half:].argmax()]), float(center[count[:half].argmax()])
+
+def measure(wave: np.ndarray, dt: float, type: str = 'MEAN'):
+    ''' Host side equivalent of the oscilloscope measurement type
+    Args:
+        wave (np.ndarray): scaled waveform samples
+        dt (float): seconds per sample
+        type (str): FREQUENCY, PDUTY, TOP, BASE, MEAN, MAXIMUM, MINIMUM, RMS, PK2PK (case insensitive)
+    Returns:
+        float: measured value
+    '''
+    type = type.upper()
+    if type == 'FREQUENCY':
+        return frequency(wave, dt)
+    if type == 'PDUTY':
+        return duty_cycle(wave)
+    if type == 'TOP':
+        return top_base(wave)[0]
+    if type == 'BASE':
+        return top_base(wave)[1]
+    return statistics(wave)[type]
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, bins: int):
+    ''' Keep the minimum and the maximum of each bin, so the peaks of a long waveform are still drawn
+    Args:
+        x (np.ndarray): sample time, ascending
+        y (np.ndarray): sample values
+        bins (int): number of bins, at most 2 * (bins + 1) points are returned
+    Returns:
+        tuple: (x, y) of the kept samples in time order
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = y.size
+    if n <= 2 * bins:
+        return x, y
+    width = -(-n // bins) # ceil
+    full = n // width * width
+    block = y[:full].reshape(-1, width)
+    offset = np.arange(0, full, width)
+    index = [offset + block.argmin(axis=1), offset + block.argmax(axis=1)]
+    if full < n:
+        # the last partial bin
+        index.append(np.array([full + y[full:].argmin(), full + y[full:].argmax()]))
+    index = np.unique(np.concatenate(index))
+    return x[index], y[index]
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int):
+    ''' Largest-Triangle-Three-Buckets downsampling, keeps the shape of a trend with threshold points
+    Args:
+        x (np.ndarray): sample time, ascending
+        y (np.ndarray): sample values
+        threshold (int): number of returned points
+    Returns:
+        tuple: (x, y) of the kept samples, the first and the last sample are always kept
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = y.size
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / (threshold - 2)
+    index = np.empty(threshold, dtype=np.intp)
+    index[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third point of the triangle
+        start = int((i + 1) * every) + 1
+        stop = min(int((i + 2) * every) + 1, n)
+        avg_x = x[start:stop].mean()
+        avg_y = y[start:stop].mean()
+        # point of this bucket making the largest triangle with the last kept point
+        first = int(i * every) + 1
+        last = int((i + 1) * every) + 1
+        area = np.abs((x[a] - avg_x) * (y[first:last] - y[a]) - (x[a] - x[first:last]) * (avg_y - y[a]))
+        a = first + int(area.argmax())
+        index[i + 1] = a
+    index[-1] = n - 1
+    return x[index], y[index]
+
+class Record:
+    '''
+    Unscaled levels of one channel and the scaling factors of Oscilloscope.retrieveAcqSetting(),
+    scaled values are computed when asked, so a memory-mapped record is not loaded as a whole.
+    '''
+    def __init__(self, levels: np.ndarray, xincr: float, xzero: float = 0.0,
+                 ymult: float = 1.0, yzero: float = 0.0, yoff: float = 0.0, yunit: str = 'V'):
+        self.levels = levels
+        self.xincr = xincr
+        self.xzero = xzero
+        self.ymult = ymult
+        self.yzero = yzero
+        self.yoff = yoff
+        self.yunit = yunit.strip().strip('"')
+
+    def __len__(self):
+        return len(self.levels)
+
+    def metadata(self):
+        return {'xincr': self.xincr, 'xzero': self.xzero, 'ymult': self.ymult,
+                'yzero': self.yzero, 'yoff': self.yoff, 'yunit': self.yunit}
+
+    def time(self, start: int = 0, stop: int = None):
+        ''' seconds of the samples [start, stop) '''
+        stop = len(self) if stop is None else stop
+        return self.xzero + np.arange(start, stop) * self.xincr
+
+    def values(self, start: int = 0, stop: int = None):
+        ''' scaled values (volt, ampere) of the samples [start, stop) '''
+        return scale(np.asarray(self.levels[start:stop], dtype=np.float64), self.ymult, self.yzero, self.yoff)
+
+    def save_csv(self, file_name: str, chunk: int = 1 << 16):
+        ''' Save time and value columns as text, formatted a chunk of rows at a time
+        Args:
+            file_name (str): file name without extension
+            chunk (int): rows formatted in one string operation
+        '''
+        with open(file_name + '.csv', 'w') as f:
+            f.write('s,' + self.yunit + '\n')
+            for start in range(0, len(self), chunk):
+                stop = min(start + chunk, len(self))
+                rows = np.column_stack((self.time(start, stop), self.values(start, stop)))
+                f.write(('%.9g,%.6g\n' * (stop - start)) % tuple(rows.ravel().tolist()))
+
+    def save_npy(self, file_name: str):
+        ''' Save the levels as .npy and the scaling factors as .json, load() maps the .npy back from disk '''
+        np.save(file_name + '.npy', np.asarray(self.levels))
+        self.save_metadata(file_name)
+
+    def save_metadata(self, file_name: str):
+        ''' Save the scaling factors as .json next to the .npy levels '''
+        with open(file_name + '.json', 'w') as f:
+            json.dump(self.metadata(), f)
+
+    def save_npz(self, file_name: str, compress: bool = True):
+        ''' Save the levels and the scaling factors in one .npz archive, smaller but not memory-mappable '''
+        save = np.savez_compressed if compress else np.savez
+        save(file_name + '.npz', levels=np.asarray(self.levels), **self.metadata())
+
+    @classmethod
+    def load(cls, file_name: str, mmap: bool = True):
+        ''' Load a record saved by save_npy() or save_npz(), file_name with extension
+        Args:
+            mmap (bool): map the .npy levels from disk instead of reading them into memory
+        '''
+        if file_name.endswith('.npz'):
+            with np.load(file_name) as data:
+                metadata = {key: data[key].item() for key in data.files if key != 'levels'}
+                return cls(data['levels'], **metadata)
+        with open(os.path.splitext(file_name)[0] + '.json') as f:
+            metadata = json.load(f)
+        return cls(np.load(file_name, mmap_mode='r' if mmap else None), **metadata)
+
+def benchmark(points: int = 1_000_000, directory: str = '.'):
+    ''' Compare the per-sample csv writer of Oscilloscope.saveCurve() with the Record formats
+    Returns:
+        dict: key format, value dict of seconds, bytes and points per second
+    '''
+    record = Record(np.random.randint(-128, 128, points).astype(np.int8), 1e-6, -0.2, 0.04, 0.0, 0.0)
+    file_name = os.path.join(directory, 'waveform_benchmark')
+    def legacy():
+        scaled_time = record.time()
+        scaled_wave = record.values()
+        f = open(file_name + '_legacy.csv', 'w')
+        f.write('s' + ',' + record.yunit + '\n')
+        for i in range(points):
+            f.write(str(scaled_time[i]) + ',' + str(scaled_wave[i]) + '\n')
+        f.close()
+        return [file_name + '_legacy.csv']
+    writers = {
+        'legacy csv': legacy,
+        'csv': lambda: record.save_csv(file_name) or [file_name + '.csv'],
+        'npy': lambda: record.save_npy(file_name) or [file_name + '.npy', file_name + '.json'],
+        'npz': lambda: record.save_npz(file_name) or [file_name + '.npz'],
+    }
+    result = {}
+    for name, writer in writers.items():
+        t1 = time.perf_counter()
+        files = writer()
+        seconds = time.perf_counter() - t1
+        size = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            os.remove(f)
+        result[name] = {'seconds': seconds, 'bytes': size, 'points per second': points / seconds}
+    return result
+
+if __name__ == '__main__':
+    for name, res in benchmark().items():
+        print('%-10s %8.3f s %12d bytes %14.0f points/s'%(name, res['seconds'], res['bytes'], res['points per second']))